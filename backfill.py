@@ -0,0 +1,341 @@
+# backfill.py
+from utility.calibration import Calibrator
+from utility.archive import Archive
+from openpyxl import load_workbook
+from utility.logger import logger
+from typing import Dict, Any, Iterator, Tuple, List
+from database import Database
+import numpy as np
+import tempfile
+import datetime
+import argparse
+import json
+import time
+import csv
+import os
+import re
+
+DT_FORMATS = ("%m-%d-%Y@%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S")
+IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+class Backfill(object):
+    """
+        Backfill replays readings that never reached MariaDB (XLSX workbooks written by
+        XLSXWriter, CSV exports and node spool files) in large transactions, skipping rows
+        whose (Node, DT) already exists in the target table (looked up through the NodeDT
+        index in schema.sql) or in the retention archive.
+            database --> Database used to open the bulk connection
+            chunk_size --> rows per sensor per transaction
+            method --> "executemany" or "infile" (LOAD DATA LOCAL INFILE)
+            calibrator --> optional Calibrator filling calibrated columns that are missing
+            archive --> Archive of rows moved out by the retention job, checked for duplicates
+
+        Spool files are JSON lines, one transmitted packet per line:
+            {"PH_Meter": {"Node": 2, "DT": "11-02-2023@14:20:00", "raw_value": 13211, "raw_voltage": 2.48}}
+    """
+
+    CHUNK_SIZE = 10000
+    METHODS = ("executemany", "infile")
+    DROPPED_COLUMNS = ("ID", "color_rgb_bytes")
+    ARCHIVE_CACHE = 4 # archive files whose keys are kept in memory between chunks
+
+    def __init__(self,
+                 database: Database,
+                 chunk_size: int=CHUNK_SIZE,
+                 method: str="executemany",
+                 calibrator: Calibrator=None,
+                 archive: Archive=None ) -> None:
+        if method not in Backfill.METHODS:
+            raise ValueError(f"Unknown backfill method {method}, expected one of {Backfill.METHODS}")
+
+        self.__database = database
+        self.__chunk_size = chunk_size
+        self.__method = method
+        self.__calibrator = calibrator
+        self.__archive = archive or Archive()
+        self.__archived_keys = {}
+        self.__stats = {"read": 0, "inserted": 0, "duplicates": 0, "rejected": 0}
+        self.__started = None
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """
+            Property method for row counters of the current run
+        """
+        return dict(self.__stats)
+
+    def _read_xlsx(self, path: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+            Method for streaming rows from every sensor sheet of a workbook
+                *args -> str file path
+        """
+        workbook = load_workbook(path, read_only=True)
+        try:
+            for sheet in workbook.worksheets:
+                rows = sheet.iter_rows(values_only=True)
+                headers = next(rows, None)
+                if not headers:
+                    continue
+                for values in rows:
+                    yield sheet.title, dict(zip(headers, values))
+        finally:
+            workbook.close()
+
+    def _read_csv(self, path: str, sensor: str=None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+            Method for streaming rows from a CSV export, the sensor defaults to the file name
+                *args -> str file path, str sensor name
+        """
+        sensor = sensor or os.path.splitext(os.path.basename(path))[0]
+        with open(path, "r", newline="") as file:
+            for row in csv.DictReader(file):
+                yield sensor, row
+
+    def _read_spool(self, path: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+            Method for streaming readings from a JSON lines spool file
+                *args -> str file path
+        """
+        with open(path, "r") as file:
+            for line_number, line in enumerate(file, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    packet = json.loads(line)
+                except json.JSONDecodeError as json_error:
+                    logger.error(f"Skipping line {line_number} of {path}: {json_error}")
+                    self.__stats["rejected"] += 1
+                    continue
+                for sensor, readings in packet.items():
+                    if isinstance(readings, dict):
+                        yield sensor, readings
+
+    def _read(self, path: str, sensor: str=None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+            Method for choosing a reader from the file extension
+                *args -> str file path, str sensor name
+        """
+        extension = os.path.splitext(path)[1].lower()
+        if extension in (".xlsx", ".xlsm"):
+            return self._read_xlsx(path)
+        if extension == ".csv":
+            return self._read_csv(path, sensor)
+        return self._read_spool(path)
+
+    @staticmethod
+    def _parse_dt(value) -> datetime.datetime:
+        """
+            Method for converting stored timestamps to second precision datetimes
+                *args -> datetime or str timestamp
+        """
+        if isinstance(value, datetime.datetime):
+            return value.replace(microsecond=0)
+        if isinstance(value, str):
+            for dt_format in DT_FORMATS:
+                try:
+                    return datetime.datetime.strptime(value.strip(), dt_format)
+                except ValueError:
+                    continue
+        return None
+
+    def _normalize(self, sensor: str, row: Dict[str, Any]) -> Dict[str, Any]:
+        """
+            Method for cleaning a row before insertion, returns None if it is unusable
+                *args -> str sensor name, dict row
+        """
+        if not IDENTIFIER.match(sensor):
+            return None
+
+        row = {key: (None if value == "" else value) for key, value in row.items()
+               if key and key not in Backfill.DROPPED_COLUMNS}
+
+        row["DT"] = self._parse_dt(row.get("DT"))
+        if row["DT"] is None or row.get("Node") is None:
+            return None
+
+        try:
+            row["Node"] = int(row["Node"])
+        except (TypeError, ValueError):
+            return None
+
+        if not all(IDENTIFIER.match(key) for key in row):
+            return None
+        return row
+
+    def _calibrate(self, sensor: str, rows: List[Dict[str, Any]]) -> None:
+        """
+            Method for filling missing calibrated values for a whole chunk at once
+                *args -> str sensor name, list rows
+        """
+        curve = self.__calibrator.curve(None, sensor)
+        if curve is None:
+            return
+
+        missing = [row for row in rows if row.get(curve.field) is None and row.get("raw_voltage") is not None]
+        if not missing:
+            return
+
+        values = self.__calibrator.calibrate(
+            sensor,
+            [row["Node"] for row in missing],
+            [float(row["raw_voltage"]) for row in missing]
+        )
+        for row, value in zip(missing, values):
+            row[curve.field] = None if np.isnan(value) else round(float(value), 6)
+
+    def _existing_keys(self, cur, sensor: str, rows: List[Dict[str, Any]]) -> set:
+        """
+            Method for fetching the (Node, DT) pairs of a chunk that are already stored
+                *args -> cursor, str sensor name, list rows
+        """
+        nodes = sorted({row["Node"] for row in rows})
+        placeholders = ",".join("?" for _ in nodes)
+        cur.execute(
+            f"SELECT Node, DT FROM {sensor} WHERE DT BETWEEN ? AND ? AND Node IN ({placeholders})",
+            (min(row["DT"] for row in rows), max(row["DT"] for row in rows), *nodes)
+        )
+        return {(int(node), dt) for node, dt in cur.fetchall()}
+
+    def _archived_keys(self, sensor: str, rows: List[Dict[str, Any]]) -> List[set]:
+        """
+            Method for the (Node, DT) pairs of the archive files overlapping a chunk; each file
+            is read once and kept while consecutive chunks fall in its range
+                *args -> str sensor name, list rows
+        """
+        entries = self.__archive.overlapping(
+            sensor,
+            min(row["DT"] for row in rows),
+            max(row["DT"] for row in rows) + datetime.timedelta(seconds=1)
+        )
+
+        key_sets = []
+        for entry in entries:
+            if entry["file"] not in self.__archived_keys:
+                if len(self.__archived_keys) >= Backfill.ARCHIVE_CACHE:
+                    self.__archived_keys.pop(next(iter(self.__archived_keys)))
+                self.__archived_keys[entry["file"]] = {(row["Node"], row["DT"]) for row in self.__archive.read_entry(entry)}
+            key_sets.append(self.__archived_keys[entry["file"]])
+        return key_sets
+
+    def _insert_executemany(self, cur, sensor: str, columns: List[str], rows: List[Dict[str, Any]]) -> None:
+        """
+            Method for inserting a chunk with a single batched statement
+        """
+        query = f"INSERT INTO {sensor} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+        cur.executemany(query, [tuple(row.get(column) for column in columns) for row in rows])
+
+    def _insert_infile(self, cur, sensor: str, columns: List[str], rows: List[Dict[str, Any]]) -> None:
+        """
+            Method for inserting a chunk through a temporary CSV and LOAD DATA LOCAL INFILE
+        """
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", newline="", delete=False) as file:
+            writer = csv.writer(file)
+            for row in rows:
+                writer.writerow(["\\N" if row.get(column) is None else row[column] for column in columns])
+            temp_path = file.name
+
+        try:
+            cur.execute(
+                f"LOAD DATA LOCAL INFILE '{temp_path}' INTO TABLE {sensor} "
+                f"FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' LINES TERMINATED BY '\\r\\n' "
+                f"({', '.join(columns)})"
+            )
+        finally:
+            os.remove(temp_path)
+
+    def _flush(self, conn, sensor: str, rows: List[Dict[str, Any]]) -> None:
+        """
+            Method for writing one chunk of a sensor's rows in a single transaction
+                *args -> connection, str sensor name, list rows
+        """
+        if self.__calibrator:
+            self._calibrate(sensor, rows)
+
+        cur = conn.cursor()
+        try:
+            existing = self._existing_keys(cur, sensor, rows)
+            archived = self._archived_keys(sensor, rows)
+            fresh = []
+            for row in rows:
+                key = (row["Node"], row["DT"])
+                if key not in existing and not any(key in keys for keys in archived):
+                    existing.add(key)
+                    fresh.append(row)
+
+            if fresh:
+                columns = ["Node", "DT"] + sorted({key for row in fresh for key in row} - {"Node", "DT"})
+                if self.__method == "infile":
+                    self._insert_infile(cur, sensor, columns, fresh)
+                else:
+                    self._insert_executemany(cur, sensor, columns, fresh)
+            conn.commit()
+
+            self.__stats["inserted"] += len(fresh)
+            self.__stats["duplicates"] += len(rows) - len(fresh)
+        except Exception as e:
+            conn.rollback()
+            self.__stats["rejected"] += len(rows)
+            logger.error(f"Error while loading {len(rows)} {sensor} rows: {e}")
+        finally:
+            cur.close()
+
+        elapsed = time.monotonic() - self.__started
+        logger.info(
+            f"Flushed {len(rows)} {sensor} rows. Total: {self.__stats['read']} read, {self.__stats['inserted']} inserted, "
+            f"{self.__stats['duplicates']} duplicates ({self.__stats['read'] / elapsed:.0f} rows/s)"
+        )
+
+    def load(self, paths: List[str], sensor: str=None) -> Dict[str, int]:
+        """
+            Method for replaying every file into the database
+                *args -> list file paths, str sensor name for CSV files
+        """
+        self.__started = time.monotonic()
+        conn = self.__database.connect(local_infile=self.__method == "infile")
+        conn.autocommit = False
+        buffers = {}
+
+        try:
+            for path in paths:
+                logger.info(f"Backfilling from {path}...")
+                for sensor_name, row in self._read(path, sensor):
+                    self.__stats["read"] += 1
+                    row = self._normalize(sensor_name, row)
+                    if row is None:
+                        self.__stats["rejected"] += 1
+                        continue
+
+                    buffer = buffers.setdefault(sensor_name, [])
+                    buffer.append(row)
+                    if len(buffer) >= self.__chunk_size:
+                        self._flush(conn, sensor_name, buffer)
+                        buffers[sensor_name] = []
+
+            for sensor_name, buffer in buffers.items():
+                if buffer:
+                    self._flush(conn, sensor_name, buffer)
+        finally:
+            conn.close()
+
+        elapsed = time.monotonic() - self.__started
+        logger.info(f"Backfill complete in {elapsed:.1f} seconds: {self.__stats}")
+        return self.stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk load XLSX, CSV and spool files into MariaDB")
+    parser.add_argument("paths", nargs="+", help="files to replay (.xlsx, .csv or JSON lines spool)")
+    parser.add_argument("--sensor", help="target table for CSV files (defaults to the file name)")
+    parser.add_argument("--method", choices=Backfill.METHODS, default="executemany")
+    parser.add_argument("--chunk-size", type=int, default=Backfill.CHUNK_SIZE)
+    parser.add_argument("--calibrate", action="store_true", help="fill missing pH/PPM/NTU from raw voltages")
+    args = parser.parse_args()
+
+    backfill = Backfill(
+        Database(),
+        chunk_size=args.chunk_size,
+        method=args.method,
+        calibrator=Calibrator() if args.calibrate else None
+    )
+    backfill.load(args.paths, sensor=args.sensor)
@@ -1,5 +1,7 @@
 # client.py
+from utility.datagram import encode_datagram
 from utility.logger import logger
+import random
 import socket
 import json
 
@@ -8,13 +10,18 @@ class Client(object):
         Client handles TCP connection, data conversion to json packets, and transmission
             host --> IP address of server or board to connect to
             port --> target port number the server/board is listening to
+            udp_port --> target port for compact datagram readings (Server udp_port)
     """
 
     CLIENT_TIMEOUT = 10 # in seconds
 
-    def __init__( self, host: str="10.42.0.1", port: int=65432 ) -> None:
+    def __init__( self, host: str="10.42.0.1", port: int=65432, udp_port: int=65433 ) -> None:
         self.__host = host
         self.__port = port
+        self.__udp_port = udp_port
+        self.__udp_socket = None
+        self.__session = random.getrandbits(32)
+        self.__sequence = 0
 
     async def _package_data(self, data: dict) -> bytes:
         """
@@ -39,4 +46,26 @@ class Client(object):
             logger.error(f"Connection with {self.__host} on port {self.__port} timedout.")
         except RuntimeError as runtime_error:
             logger.error(f"Error occurred while establishing connection with {self.__host} on port {self.__port}: {runtime_error}")
-            
\ No newline at end of file
+
+    async def transmit_datagram(self, data: dict, node: int) -> None:
+        """
+            Method for sending a small, loss tolerant reading as a single UDP datagram,
+            without the TCP handshake and time sync. The socket is kept open so the
+            source port (and so the hub worker receiving it) stays the same.
+            Packets too large for one datagram are sent over TCP instead.
+                *args -> dict sensor data, int node id
+        """
+        try:
+            datagram = encode_datagram(node, self.__session, self.__sequence, data)
+        except ValueError as size_error:
+            logger.warning(f"{size_error} Sending over TCP instead.")
+            await self.transmit(data)
+            return
+
+        self.__sequence += 1
+        try:
+            if self.__udp_socket is None:
+                self.__udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.__udp_socket.sendto(datagram, (self.__host, self.__udp_port))
+        except OSError as os_error:
+            logger.error(f"Error sending datagram to {self.__host} on port {self.__udp_port}: {os_error}")
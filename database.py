@@ -1,24 +1,53 @@
 # database.py
+from utility.archive import Archive
 import utility.config as config
 from utility.logger import logger
-from typing import Dict, Any
+from typing import Dict, Any, Iterator
 import datetime
+import heapq
 import mariadb
 import asyncio
+import re
+
+IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
 
 
 class Database(object):
+    """
+        Database handles MariaDB connections, sensor writes and range reads
+            archive --> Archive of rows moved out by the retention job, merged into reads
+    """
+
+    READ_CHUNK = 1000 # rows fetched per round trip when reading
+    CONNECT_TIMEOUT = 5 # in seconds
+    IO_TIMEOUT = 10 # in seconds, per read/write on the socket of a sensor write
+
     def __init__(
             self,
             user: str=config.DATABASE_USER,
             password: str=config.DATABASE_PASSWORD,
             host: str=config.DATABASE_HOST,
-            database_name: str=config.DATABASE_NAME ) -> None:
+            database_name: str=config.DATABASE_NAME,
+            archive: Archive=None ) -> None:
         self.__user = user
         self.__password = password
         self.__host = host
         self.__database_name = database_name
         self.__database_lock = asyncio.Lock()
+        self.__archive = archive or Archive()
+
+    def connect(self, **kwargs) -> mariadb.Connection:
+        """
+            Method for opening a new connection for bulk jobs that manage their own transactions
+                **kwargs -> extra mariadb.connect options
+        """
+        return mariadb.connect(
+            user=self.__user,
+            password=self.__password,
+            host=self.__host,
+            database=self.__database_name,
+            **kwargs
+        )
 
     async def write(self, sensor: str, readings: Dict[str, Any]) -> None:
         """
@@ -28,11 +57,11 @@ class Database(object):
         """
         logger.info("Establishing connection to MariaDb")
         async with self.__database_lock:
-            self.conn= mariadb.connect(
-                user=self.__user,
-                password=self.__password,
-                host=self.__host,
-                database=self.__database_name
+            # Socket timeouts so an unresponsive server raises instead of blocking the sink thread
+            self.conn = self.connect(
+                connect_timeout=Database.CONNECT_TIMEOUT,
+                read_timeout=Database.IO_TIMEOUT,
+                write_timeout=Database.IO_TIMEOUT
             )
 
             try:
@@ -50,8 +79,10 @@ class Database(object):
                 self.cur.close()
             except mariadb.Error as mariadb_error:
                 logger.error(f"Error when trying to write {sensor} data to database: {mariadb_error}")
+                raise
             except Exception as e:
                 logger.exception(f"Error while writing to database: {e}")
+                raise
             finally:
                 logger.info("MariaDb connection closed.")
                 self.conn.close()
@@ -67,4 +98,66 @@ class Database(object):
         query += ",?".join(["" for _ in readings])
         query += ")"
 
-        self.cur.execute(query, (readings["Node"], dt) + tuple(readings.values()))
\ No newline at end of file
+        self.cur.execute(query, (readings["Node"], dt) + tuple(readings.values()))
+
+    def read(self,
+             sensor: str,
+             start: datetime.datetime=None,
+             end: datetime.datetime=None,
+             nodes: list=None ) -> Iterator[Dict[str, Any]]:
+        """
+            Generator of a sensor's rows in [start, end) in DT order, optionally limited to nodes.
+            Rows moved to the archive are merged with the live rows; rows of an archive run
+            whose delete has not finished yet are only taken from the archive.
+                *args -> str sensor name, datetime start, datetime end, list node ids
+        """
+        if not IDENTIFIER.match(sensor):
+            raise ValueError(f"Invalid sensor table name: {sensor}")
+
+        yield from heapq.merge(self.__archive.read(sensor, start, end, nodes),
+                               self._read_live(sensor, start, end, nodes),
+                               key=lambda row: row["DT"])
+
+    def _read_live(self,
+                   sensor: str,
+                   start: datetime.datetime=None,
+                   end: datetime.datetime=None,
+                   nodes: list=None ) -> Iterator[Dict[str, Any]]:
+        """
+            Generator of a sensor's rows still in MariaDB in DT order, leaving out rows that are
+            also in the archive because their delete is pending
+                *args -> str sensor name, datetime start, datetime end, list node ids
+        """
+        conditions = []
+        params = []
+        for condition, value in (("DT >= ?", start), ("DT < ?", end)):
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+        for entry in self.__archive.pending(sensor):
+            conditions.append("NOT (ID <= ? AND DT < ?)")
+            params.extend((entry["max_id"], datetime.datetime.fromisoformat(entry["cutoff"])))
+        if nodes:
+            conditions.append(f"Node IN ({', '.join('?' for _ in nodes)})")
+            params.extend(int(node) for node in nodes)
+
+        query = f"SELECT * FROM {sensor}"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY DT"
+
+        conn = self.connect()
+        try:
+            # Unbuffered (server-side) cursor so memory stays flat however large the range is
+            cur = conn.cursor(buffered=False)
+            cur.execute(query, tuple(params))
+            columns = [description[0] for description in cur.description]
+
+            rows = cur.fetchmany(Database.READ_CHUNK)
+            while rows:
+                for row in rows:
+                    yield dict(zip(columns, row))
+                rows = cur.fetchmany(Database.READ_CHUNK)
+            cur.close()
+        finally:
+            conn.close()
@@ -0,0 +1,371 @@
+# export.py
+import utility.config as config
+from utility.logger import logger
+from typing import Dict, Any, Iterator, List
+from urllib.parse import urlparse, parse_qs
+from database import Database
+import threading
+import datetime
+import mariadb
+import argparse
+import asyncio
+import decimal
+import json
+import csv
+import io
+import sys
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+FORMATS = ("csv", "jsonl", "parquet")
+CONTENT_TYPES = {
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet"
+}
+
+
+class _ChunkSink(object):
+    """
+        Minimal writable file object that hands back whatever was written since the last drain
+    """
+    def __init__(self) -> None:
+        self.__buffer = io.BytesIO()
+        self.__position = 0
+        self.closed = False
+
+    def write(self, data: bytes) -> int:
+        self.__buffer.write(data)
+        self.__position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.__position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = self.__buffer.getvalue()
+        self.__buffer = io.BytesIO()
+        return data
+
+
+class Exporter(object):
+    """
+        Exporter streams a sensor's rows for a node set and time range as CSV, JSON lines or
+        Parquet. Rows come from Database.read (archive plus an unbuffered server-side cursor)
+        and are encoded CHUNK_ROWS at a time, so memory use does not grow with the export.
+            database --> Database the rows are read from
+            chunk_rows --> rows encoded per output chunk
+    """
+
+    CHUNK_ROWS = 5000
+    INTEGER_COLUMNS = ("ID", "Node")
+    NO_SUCH_TABLE = 1146 # MariaDB error code for an unknown table
+
+    def __init__(self, database: Database, chunk_rows: int=CHUNK_ROWS) -> None:
+        self.__database = database
+        self.__chunk_rows = chunk_rows
+
+    @staticmethod
+    def _plain(value):
+        """
+            Method for converting MariaDB values to JSON/CSV friendly types
+        """
+        if isinstance(value, decimal.Decimal):
+            return float(value)
+        if isinstance(value, datetime.datetime):
+            return value.isoformat(sep=" ")
+        return value
+
+    def _chunks(self, rows: Iterator[Dict[str, Any]]) -> Iterator[List[Dict[str, Any]]]:
+        """
+            Method for grouping rows into lists of at most chunk_rows
+        """
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= self.__chunk_rows:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def _encode_csv(self, chunks: Iterator[List[Dict[str, Any]]]) -> Iterator[bytes]:
+        """
+            Method for encoding chunks as CSV with a single header row
+        """
+        columns = None
+        for chunk in chunks:
+            text = io.StringIO()
+            writer = csv.writer(text)
+            if columns is None:
+                columns = list(chunk[0].keys())
+                writer.writerow(columns)
+            writer.writerows([self._plain(row.get(column)) for column in columns] for row in chunk)
+            yield text.getvalue().encode("utf-8")
+
+    def _encode_jsonl(self, chunks: Iterator[List[Dict[str, Any]]]) -> Iterator[bytes]:
+        """
+            Method for encoding chunks as one JSON object per line
+        """
+        for chunk in chunks:
+            lines = (json.dumps({key: self._plain(value) for key, value in row.items()}) for row in chunk)
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+
+    @staticmethod
+    def _arrow_value(field, value):
+        """
+            Method for casting a row value to the type of its Parquet column
+        """
+        if value is None or field.name == "DT":
+            return value
+        if field.type == pyarrow.float64():
+            return float(value)
+        return int(value)
+
+    def _encode_parquet(self, chunks: Iterator[List[Dict[str, Any]]]) -> Iterator[bytes]:
+        """
+            Method for encoding each chunk as a Parquet row group (requires pyarrow)
+        """
+        sink = _ChunkSink()
+        parquet_writer = None
+        schema = None
+        for chunk in chunks:
+            if schema is None:
+                schema = pyarrow.schema([
+                    (column, pyarrow.int64() if column in Exporter.INTEGER_COLUMNS
+                     else pyarrow.timestamp("s") if column == "DT" else pyarrow.float64())
+                    for column in chunk[0].keys()
+                ])
+                parquet_writer = pyarrow.parquet.ParquetWriter(sink, schema)
+
+            columns = {field.name: [self._arrow_value(field, row.get(field.name)) for row in chunk] for field in schema}
+            parquet_writer.write_table(pyarrow.table(columns, schema=schema))
+            yield sink.drain()
+
+        if parquet_writer:
+            parquet_writer.close()
+            yield sink.drain()
+
+    def stream(self,
+               sensor: str,
+               start: datetime.datetime=None,
+               end: datetime.datetime=None,
+               nodes: list=None,
+               file_format: str="csv" ) -> Iterator[bytes]:
+        """
+            Generator of encoded output chunks
+                *args -> str sensor name, datetime start, datetime end, list node ids, str format
+        """
+        if file_format not in FORMATS:
+            raise ValueError(f"Unknown export format {file_format}, expected one of {FORMATS}")
+        if file_format == "parquet" and pyarrow is None:
+            raise ValueError("Parquet export requires pyarrow (pip install pyarrow).")
+
+        chunks = self._chunks(self.__database.read(sensor, start, end, nodes))
+        encoder = getattr(self, f"_encode_{file_format}")
+        for data in encoder(chunks):
+            if data:
+                yield data
+
+    def export(self, stream, sensor: str, start=None, end=None, nodes=None, file_format: str="csv") -> int:
+        """
+            Method for writing an export to a binary stream, returns bytes written
+                *args -> binary stream, str sensor name, datetime start, datetime end, list node ids, str format
+        """
+        written = 0
+        for data in self.stream(sensor, start, end, nodes, file_format):
+            stream.write(data)
+            written += len(data)
+        return written
+
+
+class ExportServer(object):
+    """
+        ExportServer exposes the Exporter on the hub as a small HTTP endpoint:
+            GET /export?sensor=PH_Meter&start=2023-05-01&end=2023-09-01&nodes=1,2&format=csv
+        The response uses chunked transfer encoding. Each export runs on a thread of its own,
+        since the unbuffered MariaDB cursor must stay on one thread, and hands chunks over a
+        small queue so the next chunk is only produced once the client keeps up.
+            host: str --> IP to listen on
+            port: int --> port for export requests
+    """
+
+    EXPORT_PORT = 8080
+    REQUEST_TIMEOUT = 10 # in seconds
+    QUEUE_CHUNKS = 2 # encoded chunks buffered between the export thread and the client
+
+    def __init__(self, exporter: Exporter, host: str=config.DEFAULT_SERVER_IP, port: int=EXPORT_PORT) -> None:
+        self.__exporter = exporter
+        self.__host = host
+        self.__port = port
+
+    async def open(self) -> None:
+        """
+            Open the export endpoint and serve requests forever
+        """
+        _server = await asyncio.start_server(self._process_request, self.__host, self.__port)
+
+        async with _server:
+            logger.info(f"Export endpoint is listening on port {self.__port}...")
+            await _server.serve_forever()
+
+    @staticmethod
+    def _parse_query(url) -> Dict[str, Any]:
+        """
+            Method for turning the request query into Exporter.stream arguments
+                *args -> parsed request URL
+        """
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if "sensor" not in query:
+            raise ValueError("sensor is required")
+
+        return {
+            "sensor": query["sensor"],
+            "start": datetime.datetime.fromisoformat(query["start"]) if "start" in query else None,
+            "end": datetime.datetime.fromisoformat(query["end"]) if "end" in query else None,
+            "nodes": [int(node) for node in query["nodes"].split(",")] if "nodes" in query else None,
+            "file_format": query.get("format", "csv")
+        }
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: str, message: str) -> None:
+        """
+            Method for sending a short plain text response
+        """
+        body = f"{message}\n".encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode("utf-8") + body
+        )
+        await writer.drain()
+
+    @staticmethod
+    def _produce(chunks: Iterator[bytes], queue: asyncio.Queue, loop: asyncio.AbstractEventLoop, stop: threading.Event) -> None:
+        """
+            Method run on the export thread: advances the generator and hands each chunk, or the
+            error that ended it, to the event loop; closes the generator (and its connection) as
+            soon as the client is gone
+        """
+        def put(item) -> None:
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+        try:
+            for data in chunks:
+                put((data, None))
+                if stop.is_set():
+                    return
+            put((b"", None))
+        except Exception as e:
+            if not stop.is_set():
+                put((b"", e))
+        finally:
+            chunks.close()
+
+    async def _process_request(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+            Method for handling one HTTP export request
+        """
+        addr = writer.get_extra_info('peername')
+        queue = asyncio.Queue(maxsize=ExportServer.QUEUE_CHUNKS)
+        stop = threading.Event()
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=ExportServer.REQUEST_TIMEOUT)
+            method, target, _ = head.decode("latin-1").split("\r\n", 1)[0].split(" ", 2)
+            if method != "GET":
+                await self._respond(writer, "405 Method Not Allowed", "Only GET is supported.")
+                return
+
+            url = urlparse(target)
+            if url.path != "/export":
+                await self._respond(writer, "404 Not Found", "Use /export?sensor=...")
+                return
+
+            try:
+                arguments = self._parse_query(url)
+                if arguments["file_format"] == "parquet" and pyarrow is None:
+                    await self._respond(writer, "501 Not Implemented", "Parquet export requires pyarrow on the hub.")
+                    return
+                chunks = self.__exporter.stream(**arguments)
+                threading.Thread(target=self._produce, args=(chunks, queue, asyncio.get_running_loop(), stop),
+                                 name="export", daemon=True).start()
+
+                first, error = await queue.get()
+                if error is not None:
+                    raise error
+            except ValueError as value_error:
+                await self._respond(writer, "400 Bad Request", str(value_error))
+                return
+            except mariadb.Error as mariadb_error:
+                if getattr(mariadb_error, "errno", None) == Exporter.NO_SUCH_TABLE:
+                    await self._respond(writer, "404 Not Found", f"Unknown sensor {arguments['sensor']}.")
+                else:
+                    logger.error(f"Database error while starting export for {addr}: {mariadb_error}")
+                    await self._respond(writer, "503 Service Unavailable", "Database unavailable.")
+                return
+
+            logger.info(f"Streaming {arguments['sensor']} export as {arguments['file_format']} to {addr}")
+            writer.write(
+                f"HTTP/1.1 200 OK\r\nContent-Type: {CONTENT_TYPES[arguments['file_format']]}\r\n"
+                f"Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n".encode("utf-8")
+            )
+
+            data = first
+            while data:
+                writer.write(f"{len(data):X}\r\n".encode("utf-8") + data + b"\r\n")
+                await writer.drain()
+                data, error = await queue.get()
+                if error is not None:
+                    raise error
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+            logger.error(f"Incomplete export request from {addr}")
+        except ConnectionError as connection_error:
+            logger.error(f"Export client {addr} disconnected: {connection_error}")
+        except Exception as e:
+            logger.exception(f"Error while exporting to {addr}: {e}")
+        finally:
+            # Unblock the export thread so it sees stop and closes the generator
+            stop.set()
+            while not queue.empty():
+                queue.get_nowait()
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream sensor data out of the hub")
+    parser.add_argument("sensor", nargs="?", help="sensor table to export")
+    parser.add_argument("--start", type=datetime.datetime.fromisoformat, help="inclusive start, e.g. 2023-05-01")
+    parser.add_argument("--end", type=datetime.datetime.fromisoformat, help="exclusive end, e.g. 2023-09-01")
+    parser.add_argument("--nodes", type=int, nargs="+", help="limit to these node ids")
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("-o", "--output", help="output file (defaults to stdout)")
+    parser.add_argument("--serve", action="store_true", help="run the HTTP export endpoint instead")
+    args = parser.parse_args()
+
+    exporter = Exporter(Database())
+    if args.serve:
+        asyncio.run(ExportServer(exporter).open())
+    elif not args.sensor:
+        parser.error("sensor is required unless --serve is given")
+    elif args.output:
+        with open(args.output, "wb") as output:
+            total = exporter.export(output, args.sensor, args.start, args.end, args.nodes, args.format)
+        logger.info(f"Wrote {total} bytes to {args.output}")
+    else:
+        exporter.export(sys.stdout.buffer, args.sensor, args.start, args.end, args.nodes, args.format)
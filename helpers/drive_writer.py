@@ -3,6 +3,7 @@ from googleapiclient.http import MediaFileUpload
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from google_auth_httplib2 import AuthorizedHttp
 
 from collections import OrderedDict
 from typing import Dict, Any
@@ -10,6 +11,7 @@ from utility.logger import logger
 import utility.config as config
 import datetime
 import asyncio
+import httplib2
 import os
 
 # TODO - In write_sensor_data, need to account for RGB list when writing to Google - [45, 135, 60]
@@ -23,10 +25,13 @@ class GSWriter(object):
             drive_folder_id --> unique ID of drive folder found in URL:
                 https://
     """
+
+    HTTP_TIMEOUT = 20 # in seconds, per socket operation so a hung request raises instead of blocking the sink
+
     def __init__( self, spreadsheet_id: str=config.SPREADSHEET_ID, drive_folder_id: str=config.DRIVE_FOLDER_ID ) -> None:
         self.__credentials = self._authenticate()
-        self.__sheet_service = build("sheets", "v4", credentials=self.__credentials)
-        self.__drive_service = build("drive", "v3", credentials = self.__credentials)
+        self.__sheet_service = build("sheets", "v4", http=self._authorized_http())
+        self.__drive_service = build("drive", "v3", http=self._authorized_http())
         self.__spreadsheet_id = spreadsheet_id
         self.__drive_folder_id = drive_folder_id
         self.__lock = asyncio.Lock()
@@ -46,6 +51,12 @@ class GSWriter(object):
 
         return creds
     
+    def _authorized_http(self) -> AuthorizedHttp:
+        """
+            Method for an authorized HTTP client whose requests time out after HTTP_TIMEOUT
+        """
+        return AuthorizedHttp(self.__credentials, http=httplib2.Http(timeout=GSWriter.HTTP_TIMEOUT))
+
     async def _create_or_clear_sheet(self, sheet_name: str, headers: list) -> None:
         """
             For creating individual sheets within the Google Sheet. If sheet does not exist,
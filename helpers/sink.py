@@ -0,0 +1,261 @@
+# sink.py
+from typing import Callable, Dict, Any
+import utility.config as config
+from utility.logger import logger
+import threading
+import asyncio
+import copy
+import time
+
+
+class CircuitBreaker(object):
+    """
+        CircuitBreaker stops calls to a backend after repeated failures
+            closed --> calls go through; FAILURE_THRESHOLD consecutive failures open the breaker
+            open --> calls fail fast until RESET_TIMEOUT has passed
+            half-open --> the next call is a probe; success closes the breaker, failure reopens it
+    """
+
+    FAILURE_THRESHOLD = 3
+    RESET_TIMEOUT = 60 # in seconds
+
+    def __init__(self, name: str, failure_threshold: int=FAILURE_THRESHOLD, reset_timeout: float=RESET_TIMEOUT) -> None:
+        self.__name = name
+        self.__failure_threshold = failure_threshold
+        self.__reset_timeout = reset_timeout
+        self.__state = "closed"
+        self.__failures = 0
+        self.__opened_at = 0.0
+
+    @property
+    def state(self) -> str:
+        """
+            Property method for the breaker state, open becomes half-open once RESET_TIMEOUT passed
+        """
+        if self.__state == "open" and time.monotonic() - self.__opened_at >= self.__reset_timeout:
+            self.__state = "half-open"
+            logger.info(f"{self.__name} circuit half-open, probing backend...")
+        return self.__state
+
+    def allow(self) -> bool:
+        """
+            Method for checking whether a call may be attempted
+        """
+        return self.state != "open"
+
+    def record_success(self) -> None:
+        """
+            Method for closing the breaker after a successful call
+        """
+        if self.__state != "closed":
+            logger.info(f"{self.__name} circuit closed, backend recovered.")
+        self.__state = "closed"
+        self.__failures = 0
+
+    def record_failure(self) -> None:
+        """
+            Method for counting a failed call, opening the breaker at the threshold or on a failed probe
+        """
+        self.__failures += 1
+        if self.__state == "half-open" or self.__failures >= self.__failure_threshold:
+            if self.__state != "open":
+                logger.error(f"{self.__name} circuit open after {self.__failures} failure(s); failing fast for {self.__reset_timeout}s.")
+            self.__state = "open"
+            self.__opened_at = time.monotonic()
+
+
+class SinkThread(object):
+    """
+        SinkThread runs an event loop in a daemon thread for backends whose async methods
+        block (openpyxl, googleapiclient, mariadb), so a hung call never stalls ingest.
+        Sinks that share a backend object share its thread.
+    """
+    def __init__(self, name: str) -> None:
+        self.__loop = asyncio.new_event_loop()
+        self.__thread = threading.Thread(target=self.__loop.run_forever, name=f"sink-{name}", daemon=True)
+        self.__thread.start()
+
+    def run(self, coroutine) -> asyncio.Future:
+        """
+            Method for scheduling a coroutine on the thread, returns an awaitable on the caller's loop
+        """
+        return asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, self.__loop))
+
+    def close(self) -> None:
+        """
+            Method for stopping the thread's event loop
+        """
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
+
+
+class Sink(object):
+    """
+        Sink is an independent consumer for one storage backend: a bounded in-flight queue,
+        a deadline per call and a circuit breaker. Submitting never waits; when the queue is
+        full or the breaker is open the item is dropped and counted.
+            name --> str sink name used in logs and metrics
+            handler --> coroutine function writing one item to the backend
+            worker --> SinkThread the handler runs on
+            timeout --> deadline in seconds for one call; a blocked call cannot be interrupted,
+                        so it is a backstop above the I/O timeouts the backend clients set
+            max_pending --> queue size before items are dropped
+    """
+
+    TIMEOUT = 30 # in seconds
+    MAX_PENDING = 100
+
+    def __init__(self,
+                 name: str,
+                 handler: Callable,
+                 worker: SinkThread,
+                 timeout: float=TIMEOUT,
+                 max_pending: int=MAX_PENDING ) -> None:
+        self.__name = name
+        self.__handler = handler
+        self.__worker = worker
+        self.__timeout = timeout
+        self.__queue = asyncio.Queue(maxsize=max_pending)
+        self.__breaker = CircuitBreaker(name)
+        self.__consumer = None
+        self.__metrics = {"submitted": 0, "written": 0, "failed": 0, "timeouts": 0, "dropped": 0}
+
+    @property
+    def metrics(self) -> Dict[str, Any]:
+        """
+            Property method for the sink counters, queue depth and breaker state
+        """
+        return dict(self.__metrics, pending=self.__queue.qsize(), state=self.__breaker.state)
+
+    def submit(self, *args, **kwargs) -> bool:
+        """
+            Method for queueing one write without waiting, returns False if it was dropped
+        """
+        if self.__consumer is None:
+            self.__consumer = asyncio.get_running_loop().create_task(self._consume())
+
+        if self.__breaker.state == "open":
+            self.__metrics["dropped"] += 1
+            return False
+
+        try:
+            self.__queue.put_nowait((args, kwargs))
+        except asyncio.QueueFull:
+            self.__metrics["dropped"] += 1
+            logger.warning(f"{self.__name} sink queue full, dropping write.")
+            return False
+
+        self.__metrics["submitted"] += 1
+        return True
+
+    async def _consume(self) -> None:
+        """
+            Method for writing queued items one at a time under the deadline and breaker
+        """
+        while True:
+            args, kwargs = await self.__queue.get()
+            try:
+                if not self.__breaker.allow():
+                    self.__metrics["dropped"] += 1
+                    continue
+
+                await asyncio.wait_for(self.__worker.run(self.__handler(*args, **kwargs)), timeout=self.__timeout)
+                self.__breaker.record_success()
+                self.__metrics["written"] += 1
+            except asyncio.TimeoutError:
+                self.__metrics["timeouts"] += 1
+                self.__breaker.record_failure()
+                logger.error(f"{self.__name} sink write exceeded {self.__timeout}s deadline.")
+            except Exception as e:
+                self.__metrics["failed"] += 1
+                self.__breaker.record_failure()
+                logger.error(f"Error in {self.__name} sink: {e}")
+            finally:
+                self.__queue.task_done()
+
+
+class SinkDispatcher(object):
+    """
+        SinkDispatcher fans each packet out to the Database, XLSXWriter and GSWriter sinks and
+        each image to the Drive upload sink. The database sink takes one item per sensor, since
+        each Database.write opens its own connection and gets its own deadline. Every sink gets its own copy of the data, since
+        the writers modify what they are given.
+            database --> Database object, None to disable
+            drive_writer --> GSWriter object, None to disable
+            local_writer --> XLSXWriter object, None to disable
+    """
+
+    DATABASE_TIMEOUT = 30 # in seconds per sensor row, above Database.CONNECT_TIMEOUT + 2 * Database.IO_TIMEOUT
+    LOCAL_TIMEOUT = 30 # in seconds
+    DRIVE_TIMEOUT = 30 # in seconds, above GSWriter.HTTP_TIMEOUT
+    IMAGE_TIMEOUT = 120 # in seconds
+
+    def __init__(self,
+                 database=None,
+                 drive_writer=None,
+                 local_writer=None,
+                 store_database: bool=config.STORE_LOCAL_DATABASE,
+                 store_local: bool=config.STORE_LOCAL_FILE,
+                 store_drive: bool=config.STORE_DRIVE ) -> None:
+        self.__database = database
+        self.__GSWriter = drive_writer
+        self.__XLSXWriter = local_writer
+        self.__sinks = {}
+
+        if database and store_database:
+            self.__sinks["database"] = Sink("database", self._write_database, SinkThread("database"),
+                                            timeout=SinkDispatcher.DATABASE_TIMEOUT)
+        if local_writer and store_local:
+            self.__sinks["local"] = Sink("local", self._write_local, SinkThread("local"),
+                                         timeout=SinkDispatcher.LOCAL_TIMEOUT)
+        if drive_writer and store_drive:
+            # Google API client is not thread safe: sheet writes and uploads share one thread
+            google = SinkThread("google")
+            self.__sinks["drive"] = Sink("drive", self._write_drive, google, timeout=SinkDispatcher.DRIVE_TIMEOUT)
+            self.__sinks["image"] = Sink("image", self._upload_image, google, timeout=SinkDispatcher.IMAGE_TIMEOUT)
+
+    @property
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        """
+            Property method for the counters of every sink
+        """
+        return {name: sink.metrics for name, sink in self.__sinks.items()}
+
+    def dispatch(self, data: Dict[str, Any], timestamp: str, image_path: str=None) -> None:
+        """
+            Method for queueing a packet (and optional image) on every enabled sink
+                *args -> dict sensor data, str timestamp, str image path
+        """
+        if data:
+            if "database" in self.__sinks:
+                for sensor, readings in data.items():
+                    self.__sinks["database"].submit(sensor, copy.deepcopy(readings))
+            for name in ("local", "drive"):
+                if name in self.__sinks:
+                    self.__sinks[name].submit(copy.deepcopy(data), timestamp)
+
+        if image_path and "image" in self.__sinks:
+            self.__sinks["image"].submit(image_path)
+
+    async def _write_database(self, sensor: str, readings: Dict[str, Any]) -> None:
+        """
+            Sink handler writing one sensor's readings to MariaDB
+        """
+        await self.__database.write(sensor, readings)
+
+    async def _write_local(self, data: Dict[str, Any], timestamp: str) -> None:
+        """
+            Sink handler appending a packet to the XLSX file
+        """
+        await self.__XLSXWriter.write_sensor_data(data)
+
+    async def _write_drive(self, data: Dict[str, Any], timestamp: str) -> None:
+        """
+            Sink handler appending a packet to the Google Sheet
+        """
+        await self.__GSWriter.write_sensor_data(sensor_dict=data, timestamp_recv=timestamp)
+
+    async def _upload_image(self, image_path: str) -> None:
+        """
+            Sink handler pushing an image to the Google Drive folder
+        """
+        await self.__GSWriter.upload_to_google_drive(abs_image_path=image_path)
@@ -2,14 +2,27 @@
 from helpers.drive_writer import GSWriter
 from helpers.xlsx_writer import XLSXWriter
 from utility.utils import Controller
+from utility.profiler import Profiler
+from utility.alerts import AlertManager
+from helpers.sink import SinkDispatcher
+from supervisor import Supervisor
+from retention import Retention
+from export import Exporter, ExportServer
+from typing import Dict, Any
 from database import Database
 from server import Server
+import argparse
 import asyncio
 import busio
 import board
 
+SENSOR_LIST = ["Camera", "TDS_Meter", "Turbidity_Meter", "PH_Meter"]
 
-async def main():
+
+def create_sinks() -> Dict[str, Any]:
+    """
+        Build the storage backends shared by Server and Controller
+    """
     # Optional Datbase for storing data locally
     AgDatabase = Database()
 
@@ -19,17 +32,54 @@ async def main():
     # Optional XLSX Spreadsheet writer
     xlsx_writer = XLSXWriter()
 
-    sensor_list = ["Camera", "TDS_Meter", "Turbidity_Meter", "PH_Meter"]
+    return {"database": AgDatabase, "drive_writer": drive_writer, "local_writer": xlsx_writer}
+
+def create_controller(sinks: Dict[str, Any], dispatcher: SinkDispatcher=None, alerts=None) -> Controller:
+    """
+        Build the Controller for the sensors attached to the hub
+            *args -> dict storage backends from create_sinks, SinkDispatcher to share with the Server,
+                     AlertManager to share with the Server
+    """
     i2c = busio.I2C(board.SCL, board.SDA)
+    return Controller( sensor_list=SENSOR_LIST, i2c_bus=i2c, dispatcher=dispatcher, alerts=alerts, **sinks )
+
+async def main(udp_port: int=None):
+    sinks = create_sinks()
+
+    # One dispatcher so Server and Controller share each backend's queue, deadline and breaker
+    dispatcher = SinkDispatcher( **sinks )
+
+    # One AlertManager so rolling windows and cooldowns see readings from both
+    alerts = AlertManager()
 
-    server = Server( database=AgDatabase, drive_writer=drive_writer, local_writer=xlsx_writer )
+    server = Server( dispatcher=dispatcher, alerts=alerts, udp_port=udp_port, **sinks )
 
-    control = Controller( sensor_list=sensor_list, i2c_bus=i2c, databse=AgDatabase, drive_writer=drive_writer, local_writer=xlsx_writer )
+    control = create_controller(sinks, dispatcher, alerts)
 
     task_sensor_data = asyncio.create_task(control.gather_sensor_data())
     task_server = asyncio.create_task(server.open())
 
-    await asyncio.gather(task_sensor_data, task_server)
+    # Moves old rows and logs off the SD card into compressed archives once a day
+    task_retention = asyncio.create_task(Retention(sinks["database"]).run_forever())
+
+    # HTTP endpoint for streaming CSV/JSON lines/Parquet exports off the hub
+    task_export = asyncio.create_task(ExportServer(Exporter(sinks["database"])).open())
+
+    # SIGUSR1/SIGUSR2 and a control socket for profiling the running hub
+    task_profiler = asyncio.create_task(Profiler(metrics=lambda: server.metrics).start())
+
+    await asyncio.gather(task_sensor_data, task_server, task_retention, task_export, task_profiler)
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="AgCenter Pi 4 hub")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="number of SO_REUSEPORT ingest processes (0 runs everything in one process)")
+    parser.add_argument("--udp-port", type=int, default=None,
+                        help="also accept compact UDP datagram readings on this port")
+    args = parser.parse_args()
+
+    if args.workers > 0:
+        Supervisor( sink_factory=create_sinks, controller_factory=create_controller, local_writer_factory=XLSXWriter,
+                    workers=args.workers, udp_port=args.udp_port ).run()
+    else:
+        asyncio.run(main(udp_port=args.udp_port))
@@ -0,0 +1,214 @@
+# retention.py
+from utility.archive import Archive
+from utility.logger import logger
+from typing import Dict, Any, List
+from database import Database
+import datetime
+import argparse
+import asyncio
+import shutil
+import gzip
+import csv
+import os
+
+
+class Retention(object):
+    """
+        Retention moves rows older than a per-table age out of MariaDB into gzip CSV archives
+        and records them in the Archive manifest, so Database.read keeps returning them.
+        Rows are exported first and only then deleted, in small batched transactions, so the
+        sensor tables are never locked for long while ingest is running.
+            database --> Database used for connections
+            archive --> Archive the exported ranges are recorded in
+            max_age_days --> key is table name, value is age in days before rows are archived
+                             (tables not listed use DEFAULT_MAX_AGE_DAYS)
+            log_file --> server log that is compressed into the archive once it exceeds LOG_MAX_BYTES
+    """
+
+    DEFAULT_MAX_AGE_DAYS = 180
+    DELETE_BATCH = 500 # rows per delete transaction
+    EXPORT_CHUNK = 1000 # rows fetched per round trip when exporting
+    RUN_INTERVAL = 24 * 60 * 60 # in seconds
+    LOG_FILE = "AgServer_Log.txt"
+    LOG_MAX_BYTES = 10 * 1024 * 1024
+
+    def __init__(self,
+                 database: Database,
+                 archive: Archive=None,
+                 max_age_days: Dict[str, int]=None,
+                 log_file: str=LOG_FILE ) -> None:
+        self.__database = database
+        self.__archive = archive or Archive()
+        self.__max_age_days = max_age_days or {}
+        self.__log_file = log_file
+
+    def _cutoff(self, table: str) -> datetime.datetime:
+        """
+            Method for the midnight before which a table's rows are archived
+                *args -> str table name
+        """
+        age = self.__max_age_days.get(table, Retention.DEFAULT_MAX_AGE_DAYS)
+        cutoff = datetime.datetime.now() - datetime.timedelta(days=age)
+        return cutoff.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def _tables(self, conn) -> List[str]:
+        """
+            Method for listing the sensor tables of the database
+        """
+        cur = conn.cursor()
+        cur.execute("SHOW TABLES")
+        tables = [row[0] for row in cur.fetchall()]
+        cur.close()
+        return tables
+
+    def _export(self, conn, table: str, cutoff: datetime.datetime) -> Dict[str, Any]:
+        """
+            Method for streaming a table's rows older than cutoff into a new archive file
+                *args -> connection, str table name, datetime cutoff
+        """
+        cur = conn.cursor()
+        cur.execute(f"SELECT COUNT(*), MIN(DT), MAX(ID) FROM {table} WHERE DT < ?", (cutoff,))
+        count, start, max_id = cur.fetchone()
+        cur.close()
+
+        if not count:
+            return None
+
+        # max_id keeps two runs with the same cutoff (e.g. daily task plus a CLI run) apart
+        file_name = os.path.join(table, f"{table}_{start:%Y%m%d%H%M%S}_{cutoff:%Y%m%d%H%M%S}_{max_id}.csv.gz")
+        path = os.path.join(self.__archive.archive_dir, file_name)
+        if any(entry["file"] == file_name for entry in self.__archive.entries):
+            logger.error(f"Archive file {path} is already in the manifest; not replacing it.")
+            return None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        logger.info(f"Archiving {count} {table} rows before {cutoff} to {path}...")
+
+        # Unbuffered cursor streams rows from the server instead of loading the whole range
+        cur = conn.cursor(buffered=False)
+        cur.execute(f"SELECT * FROM {table} WHERE DT < ? AND ID <= ? ORDER BY DT", (cutoff, max_id))
+        columns = [description[0] for description in cur.description]
+
+        rows_written = 0
+        temp_path = f"{path}.tmp"
+        with gzip.open(temp_path, "wt", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(columns)
+            rows = cur.fetchmany(Retention.EXPORT_CHUNK)
+            while rows:
+                writer.writerows(["" if value is None else value for value in row] for row in rows)
+                rows_written += len(rows)
+                rows = cur.fetchmany(Retention.EXPORT_CHUNK)
+        cur.close()
+
+        with open(temp_path, "rb") as file:
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+
+        return {
+            "table": table,
+            "file": file_name,
+            "start": start.isoformat(),
+            "cutoff": cutoff.isoformat(),
+            "max_id": max_id,
+            "rows": rows_written,
+            "complete": False
+        }
+
+    def _delete(self, conn, entry: Dict[str, Any]) -> int:
+        """
+            Method for deleting archived rows in small transactions; rows inserted after the
+            export (higher ID) are left for the next run
+                *args -> connection, dict manifest entry
+        """
+        query = f"DELETE FROM {entry['table']} WHERE DT < ? AND ID <= ? LIMIT {Retention.DELETE_BATCH}"
+        cutoff = datetime.datetime.fromisoformat(entry["cutoff"])
+        deleted = 0
+
+        cur = conn.cursor()
+        while True:
+            cur.execute(query, (cutoff, entry["max_id"]))
+            conn.commit()
+            deleted += cur.rowcount
+            if cur.rowcount < Retention.DELETE_BATCH:
+                break
+        cur.close()
+
+        logger.info(f"Deleted {deleted} archived {entry['table']} rows.")
+        return deleted
+
+    def _rotate_log(self) -> None:
+        """
+            Method for compressing the server log into the archive and truncating it
+        """
+        if not os.path.exists(self.__log_file) or os.path.getsize(self.__log_file) < Retention.LOG_MAX_BYTES:
+            return
+
+        log_dir = os.path.join(self.__archive.archive_dir, "logs")
+        os.makedirs(log_dir, exist_ok=True)
+        name = os.path.splitext(os.path.basename(self.__log_file))[0]
+        path = os.path.join(log_dir, f"{name}_{datetime.datetime.now():%Y%m%d%H%M%S}.txt.gz")
+
+        with open(self.__log_file, "rb") as source, gzip.open(path, "wb") as target:
+            shutil.copyfileobj(source, target)
+
+        # The logging handler appends, so truncating in place is safe while the hub is running
+        with open(self.__log_file, "r+") as file:
+            file.truncate(0)
+        logger.info(f"Server log archived to {path}")
+
+    def run_once(self) -> Dict[str, int]:
+        """
+            Method for archiving every table once, returns rows archived per table
+        """
+        archived = {}
+        entries = self.__archive.entries
+        conn = self.__database.connect()
+        conn.autocommit = False
+
+        try:
+            # Finish deletes interrupted by a crash or power loss first
+            for entry in entries:
+                if not entry["complete"]:
+                    self._delete(conn, entry)
+                    entry["complete"] = True
+                    self.__archive.save(entries)
+
+            for table in self._tables(conn):
+                entry = self._export(conn, table, self._cutoff(table))
+                if entry is None:
+                    continue
+
+                entries.append(entry)
+                self.__archive.save(entries)
+
+                self._delete(conn, entry)
+                entry["complete"] = True
+                self.__archive.save(entries)
+                archived[table] = entry["rows"]
+        finally:
+            conn.close()
+
+        self._rotate_log()
+        logger.info(f"Retention run complete: {archived or 'nothing to archive'}")
+        return archived
+
+    async def run_forever(self) -> None:
+        """
+            Method for running the retention job every RUN_INTERVAL seconds
+        """
+        while True:
+            try:
+                await asyncio.to_thread(self.run_once)
+            except Exception as e:
+                logger.exception(f"Error during retention run: {e}")
+            await asyncio.sleep(Retention.RUN_INTERVAL)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive and delete old sensor rows")
+    parser.add_argument("--max-age", action="append", default=[], metavar="TABLE=DAYS",
+                        help=f"per-table age in days (default {Retention.DEFAULT_MAX_AGE_DAYS} for unlisted tables)")
+    args = parser.parse_args()
+
+    max_age = {table: int(days) for table, days in (item.split("=", 1) for item in args.max_age)}
+    Retention(Database(), max_age_days=max_age).run_once()
@@ -6,11 +6,12 @@
 --Temperature/Humidity Sensor ENS160
 CREATE TABLE TEMP_AHT21 (
     ID int NOT NULL AUTO_INCREMENT,
-    Node it NOT NULL,
+    Node int NOT NULL,
     DT datetime NOT NULL,
     temperature decimal(12, 6),
     relative_humidity decimal(12, 6),
-    PRIMARY KEY(ID)
+    PRIMARY KEY(ID),
+    INDEX NodeDT (Node, DT)
 );
 
 --CO2 Sensor ENS160
@@ -21,7 +22,8 @@ CREATE TABLE CO2_ENS160 (
     AQI int,
     TVOC int,
     eCO2 int,
-    PRIMARY KEY(ID)
+    PRIMARY KEY(ID),
+    INDEX NodeDT (Node, DT)
 );
 
 --RGB Sensor TCS34725
@@ -32,7 +34,8 @@ CREATE TABLE RGB_TCS34725 (
     color int,
     color_temperature int,
     lux decimal(12, 6),
-    PRIMARY KEY(ID)
+    PRIMARY KEY(ID),
+    INDEX NodeDT (Node, DT)
 );
 
 --UV/Light Intensity LTR390
@@ -44,7 +47,8 @@ CREATE TABLE UV_LTR390 (
     lux decimal(12, 6),
     light int,
     uvs decimal(12, 6),
-    PRIMARY KEY(ID)
+    PRIMARY KEY(ID),
+    INDEX NodeDT (Node, DT)
 );
 
 --IR Sensor MLX90614
@@ -54,18 +58,20 @@ CREATE TABLE IR_MLX90614 (
     DT datetime NOT NULL,
     ambient_temperature decimal(12, 6),
     object_temperature decimal(12, 6),
-    PRIMARY KEY(ID)
+    PRIMARY KEY(ID),
+    INDEX NodeDT (Node, DT)
 );
 
 --TDS Sensor
 CREATE TABLE TDS_Meter (
     ID int NOT NULL AUTO_INCREMENT,
-    Node into NOT NULL,
+    Node int NOT NULL,
     DT datetime NOT NULL,
     raw_value decimal(12, 6),
     raw_voltage decimal(12, 6),
     PPM int,
-    PRIMARY KEY(ID)
+    PRIMARY KEY(ID),
+    INDEX NodeDT (Node, DT)
 );
 
 --Turbidity Sensor
@@ -75,7 +81,9 @@ CREATE TABLE Turbidity_Meter (
     DT datetime NOT NULL,
     raw_value decimal(12, 6),
     raw_voltage decimal(12, 6),
-    PRIMARY KEY(ID)
+    NTU decimal(12, 6),
+    PRIMARY KEY(ID),
+    INDEX NodeDT (Node, DT)
 );
 
 --pH Sensor
@@ -85,5 +93,22 @@ CREATE TABLE PH_Meter (
     DT datetime NOT NULL,
     raw_value decimal(12, 6),
     raw_voltage decimal(12, 6),
-    PRIMARY KEY(ID)
+    pH decimal(12, 6),
+    PRIMARY KEY(ID),
+    INDEX NodeDT (Node, DT)
 );
+
+
+--Calibrated columns for existing databases (see utility/calibration.py)
+--ALTER TABLE Turbidity_Meter ADD COLUMN NTU decimal(12, 6) AFTER raw_voltage;
+--ALTER TABLE PH_Meter ADD COLUMN pH decimal(12, 6) AFTER raw_voltage;
+
+--(Node, DT) index for backfill dedupe and per-node range reads on existing databases (see backfill.py)
+--ALTER TABLE TEMP_AHT21 ADD INDEX NodeDT (Node, DT);
+--ALTER TABLE CO2_ENS160 ADD INDEX NodeDT (Node, DT);
+--ALTER TABLE RGB_TCS34725 ADD INDEX NodeDT (Node, DT);
+--ALTER TABLE UV_LTR390 ADD INDEX NodeDT (Node, DT);
+--ALTER TABLE IR_MLX90614 ADD INDEX NodeDT (Node, DT);
+--ALTER TABLE TDS_Meter ADD INDEX NodeDT (Node, DT);
+--ALTER TABLE Turbidity_Meter ADD INDEX NodeDT (Node, DT);
+--ALTER TABLE PH_Meter ADD INDEX NodeDT (Node, DT);
@@ -1,10 +1,65 @@
 # server.py
+from helpers.sink import SinkDispatcher
+from utility.calibration import Calibrator
+from utility.datagram import decode_datagram, SequenceTracker
+from utility.alerts import AlertManager
 import utility.config as config
 from utility.logger import logger
 from typing import Dict, Any
 import datetime
 import asyncio
 import json
+import os
+
+class DatagramIngest(asyncio.DatagramProtocol):
+    """
+        DatagramIngest receives compact UDP readings (see utility.datagram), tracks per-node
+        sequence gaps and feeds each packet into the same pipeline as TCP connections.
+            handler --> coroutine function taking the packet dict and receive timestamp
+            metrics --> the Server's counter dict
+    """
+    def __init__(self, handler, metrics: Dict[str, int]) -> None:
+        self.__handler = handler
+        self.__metrics = metrics
+        self.__tracker = SequenceTracker()
+        self.__pending = set()
+
+    @property
+    def loss(self) -> Dict[int, Dict[str, Any]]:
+        """
+            Property method for per-node datagram counters and loss rate
+        """
+        return self.__tracker.loss
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        """
+            Method called by asyncio for every datagram: validate, dedupe and hand off
+        """
+        try:
+            node, session, sequence, packet = decode_datagram(data)
+        except (ValueError, UnicodeDecodeError) as datagram_error:
+            self.__metrics["datagrams_rejected"] += 1
+            logger.warning(f"Rejected datagram from {addr}: {datagram_error}")
+            return
+
+        if not self.__tracker.record(node, session, sequence):
+            self.__metrics["datagrams_dropped"] += 1
+            return
+
+        self.__metrics["datagrams"] += 1
+        self.__metrics["readings"] += len(packet)
+
+        timestamp = datetime.datetime.now().strftime("%m-%d-%Y@%H:%M:%S")
+        task = asyncio.ensure_future(self.__handler(data=packet, timestamp=timestamp))
+        self.__pending.add(task)
+        task.add_done_callback(self.__pending.discard)
+
+    def error_received(self, exc: Exception) -> None:
+        """
+            Method called by asyncio when the socket reports an error
+        """
+        logger.error(f"UDP ingest socket error: {exc}")
+
 
 class Server(object):
     """
@@ -13,10 +68,16 @@ class Server(object):
             host: str --> IP of server
             port: int --> port for listening for connection requestions
             database --> database object used for storing data
+            reuse_port --> bind with SO_REUSEPORT so several worker processes can share the port
+            calibrator --> Calibrator converting raw voltages before storage
+            alerts --> AlertManager evaluating rolling-window rules on every reading
+            dispatcher --> SinkDispatcher shared with the Controller, built from the writers if None
+            udp_port: int --> optional port for compact datagram readings, None to disable
     """
 
     SERVER_TIMEOUT = 10 # in seconds
     MAX_TCP_QUEUE = 10 # amount of connections to queue before refusing
+    LOSS_REPORT_INTERVAL = 5 * 60 # in seconds, how often datagram loss per node is logged
 
     def __init__(self,
                  host: str=config.DEFAULT_SERVER_IP,
@@ -26,35 +87,74 @@ class Server(object):
                  local_writer=None,
                  store_database: bool=config.STORE_LOCAL_DATABASE,
                  store_local: bool=config.STORE_LOCAL_FILE,
-                 store_drive: bool=config.STORE_DRIVE ) -> None:
+                 store_drive: bool=config.STORE_DRIVE,
+                 reuse_port: bool=False,
+                 calibrator: Calibrator=None,
+                 alerts: AlertManager=None,
+                 dispatcher: SinkDispatcher=None,
+                 udp_port: int=None ) -> None:
         self.__host = host
         self.__port = port
-        self.__database = database
-        self.__GSWriter = drive_writer
-        self.__XLSXWriter = local_writer
-        self._store_database = store_database
-        self._store_local = store_local
-        self._store_drive = store_drive
+        self.__udp_port = udp_port
+        self.__datagram_ingest = None
+        self.__dispatcher = dispatcher or SinkDispatcher(
+            database=database,
+            drive_writer=drive_writer,
+            local_writer=local_writer,
+            store_database=store_database,
+            store_local=store_local,
+            store_drive=store_drive
+        )
+        self.__reuse_port = reuse_port
+        self.__calibrator = calibrator or Calibrator()
+        self.__alerts = alerts or AlertManager()
+        self.__metrics = {
+            "connections": 0,
+            "packets": 0,
+            "readings": 0,
+            "timeouts": 0,
+            "errors": 0,
+            "datagrams": 0,
+            "datagrams_dropped": 0,
+            "datagrams_rejected": 0
+        }
+
+    @property
+    def metrics(self) -> Dict[str, int]:
+        """
+            Property method for retrieving a snapshot of ingest and sink counters
+        """
+        metrics = dict(self.__metrics)
+        metrics["datagrams_lost"] = sum(node["lost"] for node in self.datagram_loss.values())
+        for sink_name, sink_metrics in self.__dispatcher.metrics.items():
+            for key, value in sink_metrics.items():
+                if isinstance(value, int):
+                    metrics[f"{sink_name}_{key}"] = value
+        return metrics
+
+    @property
+    def datagram_loss(self) -> Dict[int, Dict[str, Any]]:
+        """
+            Property method for per-node datagram counters and loss rate
+        """
+        return self.__datagram_ingest.loss if self.__datagram_ingest else {}
 
     async def _handle_data(self, data: Dict[str, Any], timestamp: str) -> None:
         """
             Method for handling client connections asynchronously:
-                writes to database
-                writes to xlsx
-                writes to Google sheet
+                converts raw voltages with the calibrator
+                evaluates alert rules
+                queues the packet for the database, xlsx and Google sheet sinks,
+                each of which writes independently with its own deadline and breaker
         """
         try:
-            if data and self._store_database and self.__database:
-                for key in data.keys():
-                    await self.__database.write(key, data[key])
-
-            if data and self._store_local and self.__XLSXWriter:
-                await self.__XLSXWriter.write_sensor_data(data)
-
-            if data and self._store_drive and self.__GSWriter:
-                await self.__GSWriter.writer_sensor_data(sesnsor_dict=data, timestamp_recv=timestamp)
+            if data:
+                self.__calibrator.apply(data)
+                self.__alerts.evaluate(data)
+                self.__dispatcher.dispatch(data, timestamp)
 
         except Exception as e:
+            self.__metrics["errors"] += 1
             logger.error(f"Error handling client data: {e}")
 
     async def open(self) -> None:
@@ -63,12 +163,42 @@ class Server(object):
             connection requests.
         """
         _server = await asyncio.start_server(
-            self._process_client, self.__host, self.__port
+            self._process_client, self.__host, self.__port,
+            backlog=Server.MAX_TCP_QUEUE,
+            reuse_port=self.__reuse_port
         )
 
-        async with _server:
-            logger.info(f"Server is listening on port {self.__port}...")
-            await _server.serve_forever()
+        transport = None
+        if self.__udp_port:
+            transport, self.__datagram_ingest = await asyncio.get_running_loop().create_datagram_endpoint(
+                lambda: DatagramIngest(self._handle_data, self.__metrics),
+                local_addr=(self.__host, self.__udp_port),
+                reuse_port=self.__reuse_port
+            )
+            logger.info(f"Server (pid {os.getpid()}) is listening for datagrams on port {self.__udp_port}...")
+
+        try:
+            async with _server:
+                logger.info(f"Server (pid {os.getpid()}) is listening on port {self.__port}...")
+                if transport:
+                    await asyncio.gather(_server.serve_forever(), self._report_datagram_loss())
+                else:
+                    await _server.serve_forever()
+        finally:
+            if transport:
+                transport.close()
+
+    async def _report_datagram_loss(self) -> None:
+        """
+            Method for periodically logging datagram loss rates per node
+        """
+        while True:
+            await asyncio.sleep(Server.LOSS_REPORT_INTERVAL)
+            for node, loss in self.datagram_loss.items():
+                logger.info(
+                    f"Node {node} datagrams: {loss['received']} received, {loss['lost']} lost "
+                    f"({loss['loss_rate']:.1%}), {loss['duplicates']} duplicates, {loss['stale']} stale, {loss['restarts']} restarts"
+                )
 
     async def _process_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
         """
@@ -76,11 +206,12 @@ class Server(object):
         """
         try:
             addr = writer.get_extra_info('peername')
+            self.__metrics["connections"] += 1
             logger.info(f"Now serving... {addr}")
 
             # Send current datetime so that node is synced with server
             current_time = datetime.datetime.now().strftime("%m-%d-%Y@%H:%M:%S")
-            current_time_bytes = json.dumps(current_time).encoe("utf-8")
+            current_time_bytes = json.dumps(current_time).encode("utf-8")
             writer.write(current_time_bytes)
             await writer.drain()
 
@@ -88,14 +219,19 @@ class Server(object):
             data = await asyncio.wait_for(reader.read(config.PACKET_SIZE), timeout=Server.SERVER_TIMEOUT)
             json_data = json.loads(data.decode())
             logger.info(f"Data received from {addr} at {current_time}")
+            self.__metrics["packets"] += 1
+            self.__metrics["readings"] += len(json_data)
 
             await self._handle_data(data=json_data, timestamp=current_time)
 
         except asyncio.TimeoutError:
+            self.__metrics["timeouts"] += 1
             logger.error(f"Connection timedout for {addr}")
         except json.JSONDecodeError as json_error:
+            self.__metrics["errors"] += 1
             logger.error(f"Error decoding JSON: {json_error}")
         except Exception as e:
+            self.__metrics["errors"] += 1
             logger.error(f"Error processing client connection {addr}: {e}")
         finally:
             writer.close()
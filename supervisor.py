@@ -0,0 +1,343 @@
+# supervisor.py
+import utility.config as config
+from utility.profiler import Profiler
+from utility.alerts import AlertManager
+from utility.logger import logger
+from typing import Callable, Dict, Any
+from server import Server
+import multiprocessing
+import asyncio
+import signal
+import queue
+import copy
+import time
+import os
+
+
+class QueuedWriter(object):
+    """
+        QueuedWriter stands in for the XLSXWriter inside child processes. The workbook is
+        loaded, appended to and saved whole on every write, so concurrent writers would
+        overwrite each other's rows; packets are instead queued to the one process that owns it.
+            local_queue --> multiprocessing queue read by the local writer process
+    """
+    def __init__(self, local_queue) -> None:
+        self.__local_queue = local_queue
+
+    async def write_sensor_data(self, data: dict) -> None:
+        """
+            Method for queueing a packet for the local writer process, raises queue.Full
+            so the local sink counts it as failed
+        """
+        self.__local_queue.put_nowait(data)
+
+
+class QueuedAlerts(object):
+    """
+        QueuedAlerts stands in for the AlertManager inside child processes. A node's packets
+        land on whichever worker accepts the connection, so rolling windows, rates and
+        cooldowns only hold if one AlertManager sees them all; packets are queued to the
+        supervisor, which evaluates them with the time they were received.
+            alert_queue --> multiprocessing queue drained by the supervisor
+    """
+    def __init__(self, alert_queue) -> None:
+        self.__alert_queue = alert_queue
+
+    def evaluate(self, data: Dict[str, Any]) -> list:
+        """
+            Method for queueing a calibrated packet for evaluation, returns no alerts itself
+                *args -> dict sensor data
+        """
+        try:
+            self.__alert_queue.put_nowait((copy.deepcopy(data), time.monotonic()))
+        except queue.Full:
+            logger.warning("Alert queue full, packet not evaluated.")
+        return []
+
+
+def _ignore_profiling_signals() -> None:
+    """
+        Replaces the supervisor's forwarding handlers inherited through fork; processes
+        with a Profiler install their own handlers once their event loop is running
+    """
+    signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+    signal.signal(signal.SIGUSR2, signal.SIG_IGN)
+
+def _child_sinks(sink_factory: Callable[[], Dict[str, Any]], local_queue) -> Dict[str, Any]:
+    """
+        Builds a child's sinks with the local file routed to its single owner process
+            *args -> sink factory, local writer queue or None
+    """
+    sinks = sink_factory()
+    sinks["local_writer"] = QueuedWriter(local_queue) if local_queue is not None else None
+    return sinks
+
+def _run_local_writer(local_writer_factory: Callable[[], Any], local_queue) -> None:
+    """
+        Entry point for the process that owns the local XLSX file and writes queued packets in order
+            *args -> local writer factory, local writer queue
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _ignore_profiling_signals()
+    local_writer = local_writer_factory()
+    loop = asyncio.new_event_loop()
+    while True:
+        data = local_queue.get()
+        try:
+            loop.run_until_complete(local_writer.write_sensor_data(data))
+        except Exception as e:
+            logger.error(f"Error writing local file: {e}")
+
+def _run_ingest_worker(worker_id: int, sink_factory: Callable[[], Dict[str, Any]], host: str, port: int, udp_port: int, metrics_queue, local_queue, alert_queue) -> None:
+    """
+        Entry point for an ingest worker process
+            *args -> int worker id, sink factory, str host, int port, int udp port, metrics queue, local writer queue, alert queue
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _ignore_profiling_signals()
+    asyncio.run(_serve_ingest(worker_id, sink_factory, host, port, udp_port, metrics_queue, local_queue, alert_queue))
+
+async def _serve_ingest(worker_id: int, sink_factory: Callable[[], Dict[str, Any]], host: str, port: int, udp_port: int, metrics_queue, local_queue, alert_queue) -> None:
+    """
+        Runs a Server bound with SO_REUSEPORT alongside its metrics reporter
+    """
+    server = Server(host=host, port=port, reuse_port=True, udp_port=udp_port, alerts=QueuedAlerts(alert_queue),
+                    **_child_sinks(sink_factory, local_queue))
+    profiler = Profiler(socket_path=Supervisor.SOCKET_PATH.format(name=f"worker{worker_id}"), metrics=lambda: server.metrics)
+    await asyncio.gather(server.open(), _report_metrics(worker_id, server, metrics_queue), profiler.start())
+
+async def _report_metrics(worker_id: int, server: Server, metrics_queue) -> None:
+    """
+        Periodically pushes the worker's ingest counters to the supervisor
+    """
+    while True:
+        await asyncio.sleep(Supervisor.METRICS_INTERVAL)
+        metrics_queue.put((worker_id, server.metrics))
+
+def _run_controller(sink_factory: Callable[[], Dict[str, Any]], controller_factory: Callable[..., Any], local_queue, alert_queue) -> None:
+    """
+        Entry point for the local Controller process
+            *args -> sink factory, controller factory, local writer queue, alert queue
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _ignore_profiling_signals()
+    asyncio.run(_serve_controller(sink_factory, controller_factory, local_queue, alert_queue))
+
+async def _serve_controller(sink_factory: Callable[[], Dict[str, Any]], controller_factory: Callable[..., Any], local_queue, alert_queue) -> None:
+    """
+        Runs the Controller's sampling loop alongside its profiler
+    """
+    control = controller_factory(_child_sinks(sink_factory, local_queue), alerts=QueuedAlerts(alert_queue))
+    profiler = Profiler(socket_path=Supervisor.SOCKET_PATH.format(name="controller"))
+    await asyncio.gather(control.gather_sensor_data(), profiler.start())
+
+
+class Supervisor(object):
+    """
+        Supervisor forks ingest worker processes that all listen on the same port
+        (the kernel balances connections between them with SO_REUSEPORT), runs the
+        local Controller in a process of its own, restarts any process that exits,
+        aggregates the ingest metrics reported by the workers and evaluates alert rules
+        for every process in one AlertManager.
+            sink_factory --> callable returning the database/drive_writer/local_writer kwargs,
+                             called inside each child so no connection is shared across a fork
+            controller_factory --> callable taking the sink kwargs and an alerts keyword and
+                                   returning a Controller, None to run ingest only
+            local_writer_factory --> callable returning the XLSXWriter, run in a process of its own
+                                     that every child queues packets to; the local_writer returned
+                                     by sink_factory is never used, None disables the local file
+            alerts_factory --> callable returning the AlertManager the supervisor evaluates with
+            workers --> number of ingest worker processes
+            udp_port --> optional datagram port, shared by the workers with SO_REUSEPORT
+                         (the kernel keeps each node's socket on one worker)
+    """
+
+    MONITOR_INTERVAL = 1 # in seconds
+    METRICS_INTERVAL = 60 # in seconds
+    RESTART_BACKOFF = 5 # minimum seconds between restarts of the same process
+    SOCKET_PATH = "/tmp/agcenter-{name}.sock" # profiler control socket of each child
+    LOCAL_QUEUE_SIZE = 1000 # packets waiting for the local writer before writes fail
+    ALERT_QUEUE_SIZE = 10000 # packets waiting for alert evaluation before they are skipped
+    GAUGE_SUFFIXES = ("_pending",) # point-in-time metrics, dropped rather than summed when a worker dies
+
+    def __init__(self,
+                 sink_factory: Callable[[], Dict[str, Any]],
+                 controller_factory: Callable[..., Any]=None,
+                 local_writer_factory: Callable[[], Any]=None,
+                 alerts_factory: Callable[[], AlertManager]=AlertManager,
+                 workers: int=os.cpu_count(),
+                 host: str=config.DEFAULT_SERVER_IP,
+                 port: int=config.DEFAULT_SERVER_PORT,
+                 udp_port: int=None ) -> None:
+        self.__sink_factory = sink_factory
+        self.__controller_factory = controller_factory
+        self.__local_writer_factory = local_writer_factory
+        self.__alerts_factory = alerts_factory
+        self.__alerts = None
+        self.__workers = max(1, workers)
+        self.__host = host
+        self.__port = port
+        self.__udp_port = udp_port
+        self.__context = multiprocessing.get_context("fork")
+        self.__metrics_queue = self.__context.Queue()
+        self.__local_queue = self.__context.Queue(Supervisor.LOCAL_QUEUE_SIZE) if local_writer_factory else None
+        self.__alert_queue = self.__context.Queue(Supervisor.ALERT_QUEUE_SIZE)
+        self.__processes = {}
+        self.__started_at = {}
+        self.__restarts = {}
+        self.__worker_metrics = {}
+        self.__retired_metrics = {}
+        self.__running = False
+
+    def _spawn(self, name: str) -> None:
+        """
+            Method for starting (or restarting) the named child process
+                *args -> str process name
+        """
+        if name == "controller":
+            target = _run_controller
+            args = (self.__sink_factory, self.__controller_factory, self.__local_queue, self.__alert_queue)
+        elif name == "local":
+            target = _run_local_writer
+            args = (self.__local_writer_factory, self.__local_queue)
+        else:
+            worker_id = int(name.split("-")[1])
+            target = _run_ingest_worker
+            args = (worker_id, self.__sink_factory, self.__host, self.__port, self.__udp_port, self.__metrics_queue, self.__local_queue, self.__alert_queue)
+
+        process = self.__context.Process(target=target, args=args, name=f"agcenter-{name}", daemon=True)
+        process.start()
+        self.__processes[name] = process
+        self.__started_at[name] = time.monotonic()
+        logger.info(f"Started {name} with pid {process.pid}")
+
+    def _check_processes(self) -> None:
+        """
+            Method for restarting any child process that has exited
+        """
+        for name, process in list(self.__processes.items()):
+            if process.is_alive():
+                continue
+
+            if time.monotonic() - self.__started_at[name] < Supervisor.RESTART_BACKOFF:
+                continue
+
+            logger.error(f"{name} (pid {process.pid}) exited with code {process.exitcode}. Restarting...")
+            process.join()
+            self._retire_metrics(name)
+            self.__restarts[name] = self.__restarts.get(name, 0) + 1
+            self._spawn(name)
+
+    def _retire_metrics(self, name: str) -> None:
+        """
+            Fold the last report of a dead worker into the retired totals so that
+            aggregate counters do not go backwards when it restarts
+                *args -> str process name
+        """
+        if not name.startswith("worker-"):
+            return
+
+        worker_id = int(name.split("-")[1])
+        last_report = self.__worker_metrics.pop(worker_id, {})
+        for key, value in last_report.items():
+            if key.endswith(Supervisor.GAUGE_SUFFIXES):
+                continue
+            self.__retired_metrics[key] = self.__retired_metrics.get(key, 0) + value
+
+    def _drain_metrics(self) -> None:
+        """
+            Method for collecting pending metric reports from the workers
+        """
+        while True:
+            try:
+                worker_id, report = self.__metrics_queue.get_nowait()
+            except queue.Empty:
+                return
+            self.__worker_metrics[worker_id] = report
+
+    def _drain_alerts(self) -> None:
+        """
+            Method for evaluating the packets every process queued for alerting
+        """
+        while True:
+            try:
+                data, received_at = self.__alert_queue.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                self.__alerts.evaluate(data, now=received_at)
+            except Exception as e:
+                logger.error(f"Error evaluating alerts: {e}")
+
+    @property
+    def metrics(self) -> Dict[str, int]:
+        """
+            Property method for aggregated ingest counters across all workers
+        """
+        totals = dict(self.__retired_metrics)
+        for report in self.__worker_metrics.values():
+            for key, value in report.items():
+                totals[key] = totals.get(key, 0) + value
+        totals["restarts"] = sum(self.__restarts.values())
+        return totals
+
+    def _stop(self, signum, frame) -> None:
+        """
+            Signal handler for shutting down the supervisor
+        """
+        logger.info(f"Supervisor received signal {signum}, shutting down...")
+        self.__running = False
+
+    def _forward(self, signum, frame) -> None:
+        """
+            Signal handler passing SIGUSR1/SIGUSR2 on to every child that runs a Profiler
+        """
+        for name, process in self.__processes.items():
+            if name != "local" and process.is_alive():
+                logger.info(f"Forwarding signal {signum} to {name} (pid {process.pid})")
+                os.kill(process.pid, signum)
+
+    def run(self) -> None:
+        """
+            Start all child processes and supervise them until SIGTERM/SIGINT
+        """
+        for worker_id in range(self.__workers):
+            self._spawn(f"worker-{worker_id}")
+        if self.__controller_factory:
+            self._spawn("controller")
+        if self.__local_writer_factory:
+            self._spawn("local")
+
+        # Built after forking so the webhook thread pool is never copied into a child
+        self.__alerts = self.__alerts_factory()
+
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        # The default action of SIGUSR1/SIGUSR2 would kill the supervisor and orphan its children
+        signal.signal(signal.SIGUSR1, self._forward)
+        signal.signal(signal.SIGUSR2, self._forward)
+
+        self.__running = True
+        last_report = time.monotonic()
+        try:
+            while self.__running:
+                self._drain_metrics()
+                self._drain_alerts()
+                self._check_processes()
+
+                if time.monotonic() - last_report >= Supervisor.METRICS_INTERVAL:
+                    logger.info(f"Ingest metrics across {self.__workers} workers: {self.metrics}")
+                    last_report = time.monotonic()
+
+                time.sleep(Supervisor.MONITOR_INTERVAL)
+        finally:
+            for name, process in self.__processes.items():
+                if process.is_alive():
+                    logger.info(f"Stopping {name} (pid {process.pid})...")
+                    process.terminate()
+            for process in self.__processes.values():
+                process.join(timeout=Supervisor.RESTART_BACKOFF)
+            logger.info("Supervisor stopped.")
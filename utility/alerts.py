@@ -0,0 +1,289 @@
+# alerts.py
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
+from collections import deque
+from .logger import logger
+import urllib.request
+import datetime
+import json
+import math
+import time
+import os
+
+ALERT_RULES_FILE = "alerts.json"
+ALERT_LOG = "alerts.jsonl"
+
+"""
+    Default rules, evaluated on the calibrated fields added by utility.calibration:
+        min/max     --> absolute thresholds
+        zscore      --> deviation from the rolling mean in rolling standard deviations
+        rate        --> absolute change per minute
+        cooldown    --> seconds before the same alert may fire again
+"""
+DEFAULT_RULES = [
+    {"sensor": "PH_Meter", "field": "pH", "min": 5.0, "max": 8.5, "zscore": 4.0, "rate": 1.0},
+    {"sensor": "TDS_Meter", "field": "PPM", "max": 900.0, "zscore": 4.0},
+    {"sensor": "Turbidity_Meter", "field": "NTU", "zscore": 4.0, "rate": 500.0},
+    {"sensor": "TEMP_AHT21", "field": "temperature", "min": 5.0, "max": 40.0, "rate": 2.0}
+]
+
+
+class RollingStats(object):
+    """
+        RollingStats keeps O(1)-update statistics of one node's field: EWMA, rolling mean and
+        standard deviation over the last `window` readings (Welford with removal) and the
+        rate of change between the last two readings.
+            window --> number of readings in the rolling mean/std
+            alpha --> EWMA smoothing factor
+    """
+
+    MIN_RATE_INTERVAL = 1.0 # in seconds, readings closer together than this give no rate
+
+    def __init__(self, window: int=60, alpha: float=0.1) -> None:
+        self.__window = deque(maxlen=window)
+        self.__alpha = alpha
+        self.__mean = 0.0
+        self.__m2 = 0.0
+        self.__ewma = None
+        self.__rate = None
+        self.__last = None
+
+    @property
+    def count(self) -> int:
+        """
+            Property method for the number of readings in the window
+        """
+        return len(self.__window)
+
+    @property
+    def mean(self) -> float:
+        """
+            Property method for the rolling mean
+        """
+        return self.__mean
+
+    @property
+    def std(self) -> float:
+        """
+            Property method for the rolling sample standard deviation
+        """
+        if len(self.__window) < 2:
+            return 0.0
+        return math.sqrt(max(self.__m2, 0.0) / (len(self.__window) - 1))
+
+    @property
+    def ewma(self) -> Optional[float]:
+        """
+            Property method for the exponentially weighted moving average
+        """
+        return self.__ewma
+
+    @property
+    def rate(self) -> Optional[float]:
+        """
+            Property method for the change per minute between the last two readings
+        """
+        return self.__rate
+
+    def zscore(self, value: float) -> float:
+        """
+            Method for the deviation of a value from the rolling mean, 0 while std is unknown
+        """
+        std = self.std
+        return (value - self.__mean) / std if std > 0 else 0.0
+
+    def rate_of_change(self, value: float, timestamp: float) -> Optional[float]:
+        """
+            Method for the change per minute from the previous reading to value
+        """
+        if self.__last is None or timestamp - self.__last[1] < RollingStats.MIN_RATE_INTERVAL:
+            return None
+        return (value - self.__last[0]) / (timestamp - self.__last[1]) * 60
+
+    def update(self, value: float, timestamp: float) -> None:
+        """
+            Method for adding a reading
+                *args -> float value, float monotonic timestamp
+        """
+        self.__rate = self.rate_of_change(value, timestamp)
+        self.__last = (value, timestamp)
+        self.__ewma = value if self.__ewma is None else self.__alpha * value + (1 - self.__alpha) * self.__ewma
+
+        if len(self.__window) == self.__window.maxlen:
+            oldest = self.__window[0]
+            remaining = len(self.__window) - 1
+            if remaining:
+                delta = oldest - self.__mean
+                self.__mean -= delta / remaining
+                self.__m2 -= delta * (oldest - self.__mean)
+            else:
+                self.__mean, self.__m2 = 0.0, 0.0
+
+        self.__window.append(value)
+        delta = value - self.__mean
+        self.__mean += delta / len(self.__window)
+        self.__m2 += delta * (value - self.__mean)
+
+
+class AlertManager(object):
+    """
+        AlertManager evaluates threshold, z-score and rate-of-change rules on every reading
+        without touching the database, and writes alerts to a JSON lines log (and optionally
+        POSTs them to a webhook). An alert for the same node, sensor, field and rule is
+        suppressed until its cooldown has elapsed.
+            rules_file --> JSON list of rules replacing DEFAULT_RULES if it exists
+            alert_log --> JSON lines file alerts are appended to
+            webhook_url --> optional URL alerts are POSTed to as JSON
+    """
+
+    WINDOW = 60 # readings in the rolling window
+    EWMA_ALPHA = 0.1
+    MIN_SAMPLES = 10 # readings before z-score rules are evaluated
+    COOLDOWN = 30 * 60 # in seconds
+    WEBHOOK_TIMEOUT = 5 # in seconds
+
+    def __init__(self,
+                 rules_file: str=ALERT_RULES_FILE,
+                 alert_log: str=ALERT_LOG,
+                 webhook_url: str=None ) -> None:
+        self.__rules = self._load_rules(rules_file)
+        self.__alert_log = alert_log
+        self.__webhook_url = webhook_url
+        self.__webhook_executor = ThreadPoolExecutor(max_workers=1) if webhook_url else None
+        self.__stats = {}
+        self.__last_fired = {}
+        self.__suppressed = 0
+
+    @staticmethod
+    def _load_rules(rules_file: str) -> List[Dict[str, Any]]:
+        """
+            Method for loading alert rules from file, falling back to DEFAULT_RULES
+                *args -> str rules file path
+        """
+        if not os.path.exists(rules_file):
+            return DEFAULT_RULES
+
+        with open(rules_file, "r") as file:
+            rules = json.load(file)
+        logger.info(f"Loaded {len(rules)} alert rules from {rules_file}")
+        return rules
+
+    @property
+    def suppressed(self) -> int:
+        """
+            Property method for the number of alerts held back by cooldown
+        """
+        return self.__suppressed
+
+    def stats(self, node, sensor: str, field: str) -> Optional[RollingStats]:
+        """
+            Method for the rolling statistics of a node's field, None if never seen
+        """
+        return self.__stats.get((str(node), sensor, field))
+
+    def _check(self, rule: Dict[str, Any], stats: RollingStats, value: float, now: float) -> List[tuple]:
+        """
+            Method for the rule conditions a reading violates, checked against the window
+            before the reading is added so a spike does not dilute its own z-score
+        """
+        violations = []
+        if rule.get("min") is not None and value < rule["min"]:
+            violations.append(("min", f"{value:.3f} below {rule['min']}"))
+        if rule.get("max") is not None and value > rule["max"]:
+            violations.append(("max", f"{value:.3f} above {rule['max']}"))
+
+        if rule.get("zscore") is not None and stats.count >= AlertManager.MIN_SAMPLES:
+            zscore = stats.zscore(value)
+            if abs(zscore) > rule["zscore"]:
+                violations.append(("zscore", f"z-score {zscore:.1f} (mean {stats.mean:.3f}, std {stats.std:.3f})"))
+
+        if rule.get("rate") is not None:
+            rate = stats.rate_of_change(value, now)
+            if rate is not None and abs(rate) > rule["rate"]:
+                violations.append(("rate", f"changing {rate:.3f}/min"))
+
+        return violations
+
+    def evaluate(self, data: Dict[str, Any], now: float=None) -> List[Dict[str, Any]]:
+        """
+            Method for updating statistics and evaluating rules for one packet, returns the alerts fired
+                *args -> dict sensor data, float monotonic time the packet was received (defaults to now)
+        """
+        now = time.monotonic() if now is None else now
+        fired = []
+        updates = {}
+
+        for rule in self.__rules:
+            readings = data.get(rule["sensor"])
+            if not isinstance(readings, dict):
+                continue
+
+            try:
+                value = float(readings[rule["field"]])
+            except (KeyError, TypeError, ValueError):
+                continue
+            if math.isnan(value):
+                continue
+
+            node = str(readings.get("Node"))
+            key = (node, rule["sensor"], rule["field"])
+            stats = self.__stats.setdefault(key, RollingStats(window=AlertManager.WINDOW, alpha=AlertManager.EWMA_ALPHA))
+
+            for kind, message in self._check(rule, stats, value, now):
+                alert = {
+                    "node": node,
+                    "sensor": rule["sensor"],
+                    "field": rule["field"],
+                    "rule": kind,
+                    "value": value,
+                    "ewma": stats.ewma,
+                    "message": message,
+                    "time": datetime.datetime.now().isoformat(timespec="seconds")
+                }
+                if self._emit(alert, rule.get("cooldown", AlertManager.COOLDOWN), now):
+                    fired.append(alert)
+
+            # Rules on the same field share its statistics, which take each reading once
+            updates[key] = (stats, value)
+
+        for stats, value in updates.values():
+            stats.update(value, now)
+
+        return fired
+
+    def _emit(self, alert: Dict[str, Any], cooldown: float, now: float) -> bool:
+        """
+            Method for recording an alert unless the same alert fired within its cooldown
+        """
+        key = (alert["node"], alert["sensor"], alert["field"], alert["rule"])
+        last_fired = self.__last_fired.get(key)
+        if last_fired is not None and now - last_fired < cooldown:
+            self.__suppressed += 1
+            return False
+        self.__last_fired[key] = now
+
+        logger.warning(f"ALERT node {alert['node']} {alert['sensor']}.{alert['field']}: {alert['message']}")
+        try:
+            with open(self.__alert_log, "a") as file:
+                file.write(json.dumps(alert) + "\n")
+        except OSError as os_error:
+            logger.error(f"Could not write alert log {self.__alert_log}: {os_error}")
+
+        if self.__webhook_executor:
+            self.__webhook_executor.submit(self._post, alert)
+        return True
+
+    def _post(self, alert: Dict[str, Any]) -> None:
+        """
+            Method for POSTing an alert to the webhook, runs off the event loop
+        """
+        request = urllib.request.Request(
+            self.__webhook_url,
+            data=json.dumps(alert).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST"
+        )
+        try:
+            urllib.request.urlopen(request, timeout=AlertManager.WEBHOOK_TIMEOUT).close()
+        except Exception as e:
+            logger.error(f"Error posting alert to webhook: {e}")
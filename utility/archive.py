@@ -0,0 +1,162 @@
+# archive.py
+from typing import Dict, Any, Iterator, List
+from .logger import logger
+import datetime
+import heapq
+import gzip
+import json
+import csv
+import os
+
+ARCHIVE_DIR = "archive"
+MANIFEST_NAME = "manifest.json"
+
+
+class Archive(object):
+    """
+        Archive keeps the manifest of rows moved out of MariaDB by the retention job and
+        reads them back. Each entry covers every row of one table with DT before its cutoff:
+            {"table": "PH_Meter", "file": "PH_Meter/PH_Meter_20230101000000_20230601000000.csv.gz",
+             "start": "2023-01-01T00:00:00", "cutoff": "2023-06-01T00:00:00", "max_id": 81234,
+             "rows": 80411, "complete": true}
+            archive_dir --> directory holding the manifest and the gzip CSV files
+    """
+
+    def __init__(self, archive_dir: str=ARCHIVE_DIR) -> None:
+        self.__archive_dir = archive_dir
+        self.__manifest_path = os.path.join(archive_dir, MANIFEST_NAME)
+        self.__entries = []
+        self.__manifest_mtime = None
+
+    @property
+    def archive_dir(self) -> str:
+        """
+            Property method for the archive directory
+        """
+        return self.__archive_dir
+
+    @property
+    def entries(self) -> List[Dict[str, Any]]:
+        """
+            Property method for the manifest entries, reloaded if another process changed them
+        """
+        self._reload()
+        return [dict(entry) for entry in self.__entries]
+
+    def _reload(self) -> None:
+        """
+            Method for re-reading the manifest when its modification time changes
+        """
+        if not os.path.exists(self.__manifest_path):
+            self.__entries = []
+            return
+
+        mtime = os.path.getmtime(self.__manifest_path)
+        if mtime != self.__manifest_mtime:
+            with open(self.__manifest_path, "r") as file:
+                self.__entries = json.load(file)
+            self.__manifest_mtime = mtime
+
+    def save(self, entries: List[Dict[str, Any]]) -> None:
+        """
+            Method for atomically replacing the manifest
+                *args -> list manifest entries
+        """
+        os.makedirs(self.__archive_dir, exist_ok=True)
+        temp_path = f"{self.__manifest_path}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump(entries, file, indent=2)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.__manifest_path)
+        self.__entries = [dict(entry) for entry in entries]
+        self.__manifest_mtime = os.path.getmtime(self.__manifest_path)
+
+    def pending(self, table: str) -> List[Dict[str, Any]]:
+        """
+            Method for a table's entries whose rows were exported but not yet deleted from
+            MariaDB, i.e. rows with ID <= max_id and DT < cutoff are in both places
+                *args -> str table name
+        """
+        return [entry for entry in self.entries if entry["table"] == table and not entry["complete"]]
+
+    def overlapping(self,
+                    table: str,
+                    start: datetime.datetime=None,
+                    end: datetime.datetime=None ) -> List[Dict[str, Any]]:
+        """
+            Method for a table's entries that may hold rows in [start, end), ordered by start
+                *args -> str table name, datetime start, datetime end
+        """
+        entries = []
+        for entry in self.entries:
+            if entry["table"] != table:
+                continue
+            if start and datetime.datetime.fromisoformat(entry["cutoff"]) <= start:
+                continue
+            if end and entry["start"] and datetime.datetime.fromisoformat(entry["start"]) >= end:
+                continue
+            entries.append(entry)
+        return sorted(entries, key=lambda entry: entry["start"])
+
+    @staticmethod
+    def _convert(value: str):
+        """
+            Method for restoring CSV text to int, float or datetime values
+        """
+        if value == "":
+            return None
+        for cast in (int, float, datetime.datetime.fromisoformat):
+            try:
+                return cast(value)
+            except ValueError:
+                continue
+        return value
+
+    def read_entry(self,
+                   entry: Dict[str, Any],
+                   start: datetime.datetime=None,
+                   end: datetime.datetime=None,
+                   nodes: list=None ) -> Iterator[Dict[str, Any]]:
+        """
+            Generator of the rows of one archive file in [start, end) in DT order, optionally limited to nodes
+                *args -> dict manifest entry, datetime start, datetime end, list node ids
+        """
+        node_set = {int(node) for node in nodes} if nodes else None
+        path = os.path.join(self.__archive_dir, entry["file"])
+        if not os.path.exists(path):
+            logger.error(f"Archive file {path} listed in manifest is missing.")
+            return
+
+        with gzip.open(path, "rt", newline="") as file:
+            for raw_row in csv.DictReader(file):
+                row = {key: self._convert(value) for key, value in raw_row.items()}
+                if start and row["DT"] < start:
+                    continue
+                if end and row["DT"] >= end:
+                    continue
+                if node_set and row["Node"] not in node_set:
+                    continue
+                yield row
+
+    def read(self,
+             table: str,
+             start: datetime.datetime=None,
+             end: datetime.datetime=None,
+             nodes: list=None ) -> Iterator[Dict[str, Any]]:
+        """
+            Generator of archived rows of a table in [start, end) in DT order, optionally limited to nodes.
+            Files whose ranges overlap (rows backfilled after an earlier run was archived) are merged,
+            the rest are read one after another so only one file is open at a time.
+                *args -> str table name, datetime start, datetime end, list node ids
+        """
+        group, group_cutoff = [], None
+        for entry in self.overlapping(table, start, end):
+            if group and entry["start"] >= group_cutoff:
+                yield from heapq.merge(*(self.read_entry(e, start, end, nodes) for e in group), key=lambda row: row["DT"])
+                group = []
+            group_cutoff = entry["cutoff"] if not group else max(group_cutoff, entry["cutoff"])
+            group.append(entry)
+
+        if group:
+            yield from heapq.merge(*(self.read_entry(e, start, end, nodes) for e in group), key=lambda row: row["DT"])
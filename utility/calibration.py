@@ -0,0 +1,293 @@
+# calibration.py
+from typing import Dict, Any, Optional
+from .logger import logger
+import numpy as np
+import argparse
+import json
+import time
+import os
+
+CALIBRATION_FILE = "calibration.json"
+
+"""
+    Default curves, (voltage, value) reference points per sensor:
+        PH_Meter        --> E-201-C reference table (4 / 7 / 10 pH), Nernst temperature compensation,
+                            extrapolated since the electrode is linear across 0 ~ 14 pH
+        TDS_Meter       --> SEN0244 linear 0 ~ 2.3v over 0 ~ 1000ppm, 2%/°C conductivity compensation
+        Turbidity_Meter --> SEN0189 NTU curve sampled over its 2.5 ~ 4.2v working range, clamped
+                            to it since the curve is not linear outside
+"""
+DEFAULT_CURVES = {
+    "PH_Meter": {
+        "field": "pH",
+        "points": [[2.066, 10.0], [2.535, 7.0], [3.071, 4.0]],
+        "temperature_model": "nernst",
+        "extrapolate": True
+    },
+    "TDS_Meter": {
+        "field": "PPM",
+        "points": [[0.0, 0.0], [2.3, 1000.0]],
+        "temperature_model": "conductivity",
+        "extrapolate": True
+    },
+    "Turbidity_Meter": {
+        "field": "NTU",
+        "points": [[2.5, 3000.0], [3.0, 2790.0], [3.5, 2020.0], [4.0, 690.0], [4.2, 0.0]],
+        "temperature_model": None,
+        "extrapolate": False
+    }
+}
+
+
+class CalibrationCurve(object):
+    """
+        CalibrationCurve converts raw voltages to engineering units with a piecewise-linear
+        fit through reference points, exact at every reference point and vectorized over a
+        whole batch with np.interp.
+            points --> list of (voltage, value) reference points
+            field --> str name of the converted column (e.g., pH)
+            temperature_model --> None, "nernst" (pH electrodes) or "conductivity" (TDS)
+            reference_temperature --> temperature in °C the reference points were taken at
+            extrapolate --> continue the end segments past the outer reference points instead
+                            of clamping to their values
+    """
+
+    NEUTRAL_PH = 7.0
+    CONDUCTIVITY_COEFFICIENT = 0.02 # per °C
+    KELVIN = 273.15
+
+    def __init__(self,
+                 points: list,
+                 field: str,
+                 temperature_model: Optional[str]=None,
+                 reference_temperature: float=25.0,
+                 extrapolate: bool=True ) -> None:
+        if len(points) < 2:
+            raise ValueError(f"Calibration curve for {field} needs at least two reference points.")
+        if temperature_model not in (None, "nernst", "conductivity"):
+            raise ValueError(f"Unknown temperature model: {temperature_model}")
+
+        reference = np.array(sorted(points), dtype=float)
+        if np.any(np.diff(reference[:, 0]) <= 0):
+            raise ValueError(f"Calibration curve for {field} has duplicate reference voltages.")
+
+        self.__field = field
+        self.__temperature_model = temperature_model
+        self.__reference_temperature = reference_temperature
+        self.__extrapolate = extrapolate
+        self.__voltages = reference[:, 0]
+        self.__values = reference[:, 1]
+        self.__low_slope = (self.__values[1] - self.__values[0]) / (self.__voltages[1] - self.__voltages[0])
+        self.__high_slope = (self.__values[-1] - self.__values[-2]) / (self.__voltages[-1] - self.__voltages[-2])
+
+    @property
+    def field(self) -> str:
+        """
+            Property method for the name of the converted column
+        """
+        return self.__field
+
+    def apply(self, voltages, temperatures=None) -> np.ndarray:
+        """
+            Method for converting a batch of voltages, with optional temperatures in °C
+                *args -> array-like voltages, array-like temperatures
+        """
+        voltages = np.asarray(voltages, dtype=float)
+        temperatures = self._fill_temperatures(temperatures, voltages.shape)
+
+        if self.__temperature_model == "conductivity":
+            voltages = voltages / (1.0 + CalibrationCurve.CONDUCTIVITY_COEFFICIENT * (temperatures - self.__reference_temperature))
+
+        values = np.interp(voltages, self.__voltages, self.__values)
+        if self.__extrapolate:
+            values = np.where(voltages < self.__voltages[0],
+                              self.__values[0] + (voltages - self.__voltages[0]) * self.__low_slope, values)
+            values = np.where(voltages > self.__voltages[-1],
+                              self.__values[-1] + (voltages - self.__voltages[-1]) * self.__high_slope, values)
+
+        if self.__temperature_model == "nernst":
+            ratio = (self.__reference_temperature + CalibrationCurve.KELVIN) / (temperatures + CalibrationCurve.KELVIN)
+            values = CalibrationCurve.NEUTRAL_PH + (values - CalibrationCurve.NEUTRAL_PH) * ratio
+
+        return values
+
+    def _fill_temperatures(self, temperatures, shape) -> np.ndarray:
+        """
+            Method for broadcasting temperatures, using the reference temperature where unknown
+        """
+        if temperatures is None:
+            return np.full(shape, self.__reference_temperature)
+
+        temperatures = np.broadcast_to(np.asarray(temperatures, dtype=float), shape)
+        return np.where(np.isnan(temperatures), self.__reference_temperature, temperatures)
+
+
+class Calibrator(object):
+    """
+        Calibrator holds the calibration curves of every node and analog channel and applies
+        them to incoming packets and to historical rows.
+            calibration_file --> JSON file of per-node overrides keyed by node then sensor, e.g.
+                {"3": {"PH_Meter": {"points": [[3.05, 4.0], [2.51, 7.0], [2.04, 10.0]], "reference_temperature": 22.5}}}
+    """
+
+    TEMPERATURE_SENSOR = "TEMP_AHT21"
+    TEMPERATURE_MAX_AGE = 30 * 60 # in seconds, how long a node's last temperature is used for compensation
+    RECOMPUTE_CHUNK = 5000 # rows per transaction
+
+    def __init__(self, calibration_file: str=CALIBRATION_FILE) -> None:
+        self.__default_curves = {sensor: CalibrationCurve(**spec) for sensor, spec in DEFAULT_CURVES.items()}
+        self.__node_curves = self._load_overrides(calibration_file)
+        self.__last_temperature = {}
+
+    def _load_overrides(self, calibration_file: str) -> Dict[str, Dict[str, CalibrationCurve]]:
+        """
+            Method for building per-node curves from the calibration file
+                *args -> str calibration file path
+        """
+        if not os.path.exists(calibration_file):
+            logger.info(f"No calibration file {calibration_file}; using default curves.")
+            return {}
+
+        with open(calibration_file, "r") as file:
+            overrides = json.load(file)
+
+        node_curves = {}
+        for node, sensors in overrides.items():
+            for sensor, spec in sensors.items():
+                merged = dict(DEFAULT_CURVES.get(sensor, {}))
+                merged.update(spec)
+                try:
+                    node_curves.setdefault(str(node), {})[sensor] = CalibrationCurve(**merged)
+                except (TypeError, ValueError) as curve_error:
+                    logger.error(f"Invalid calibration for node {node} {sensor}: {curve_error}")
+
+        logger.info(f"Loaded calibration overrides for nodes: {', '.join(node_curves)}")
+        return node_curves
+
+    def curve(self, node, sensor: str) -> Optional[CalibrationCurve]:
+        """
+            Method for looking up the curve of a node's channel, falling back to the default
+                *args -> node id, str sensor name
+        """
+        return self.__node_curves.get(str(node), {}).get(sensor, self.__default_curves.get(sensor))
+
+    def calibrate(self, sensor: str, nodes, voltages, temperatures=None) -> Optional[np.ndarray]:
+        """
+            Method for converting a batch of readings that may span several nodes
+                *args -> str sensor name, array-like node ids, array-like voltages, array-like temperatures
+        """
+        nodes = np.asarray(nodes).astype(str)
+        voltages = np.asarray(voltages, dtype=float)
+        if temperatures is not None:
+            temperatures = np.asarray(temperatures, dtype=float)
+
+        if sensor not in self.__default_curves and not any(sensor in curves for curves in self.__node_curves.values()):
+            return None
+
+        values = np.full(voltages.shape, np.nan)
+        for node in np.unique(nodes):
+            curve = self.curve(node, sensor)
+            if curve is None:
+                continue
+            mask = nodes == node
+            values[mask] = curve.apply(voltages[mask], None if temperatures is None else temperatures[mask])
+
+        return values
+
+    def _packet_temperature(self, data: Dict[str, Any]) -> float:
+        """
+            Method for finding the temperature to compensate a packet with, remembering the
+            last TEMP_AHT21 reading of each node for packets that do not carry one
+                *args -> dict sensor data
+        """
+        nodes = [readings.get("Node") for readings in data.values() if isinstance(readings, dict)]
+        node = str(nodes[0]) if nodes else None
+
+        reading = data.get(Calibrator.TEMPERATURE_SENSOR)
+        if isinstance(reading, dict) and reading.get("temperature") is not None:
+            self.__last_temperature[node] = (float(reading["temperature"]), time.monotonic())
+
+        temperature, recorded = self.__last_temperature.get(node, (np.nan, 0.0))
+        if time.monotonic() - recorded > Calibrator.TEMPERATURE_MAX_AGE:
+            return np.nan
+        return temperature
+
+    def apply(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+            Method for adding calibrated values to a packet in place
+                *args -> dict sensor data
+        """
+        temperature = self._packet_temperature(data)
+
+        for sensor, readings in data.items():
+            if not isinstance(readings, dict) or readings.get("raw_voltage") is None:
+                continue
+
+            curve = self.curve(readings.get("Node"), sensor)
+            if curve is None:
+                continue
+
+            value = curve.apply([readings["raw_voltage"]], [temperature])[0]
+            readings[curve.field] = round(float(value), 6)
+
+        return data
+
+    def recompute(self, database, sensor: str) -> int:
+        """
+            Method for recalculating the calibrated column of a sensor table from its stored
+            raw voltages, chunk by chunk, using each node's nearest earlier TEMP_AHT21 reading
+                *args -> Database, str sensor name
+        """
+        field = self.__default_curves[sensor].field
+        select_query = (
+            f"SELECT s.ID, s.Node, s.raw_voltage, "
+            f"(SELECT t.temperature FROM {Calibrator.TEMPERATURE_SENSOR} t "
+            f"WHERE t.Node = s.Node AND t.DT <= s.DT ORDER BY t.DT DESC LIMIT 1) "
+            f"FROM {sensor} s WHERE s.ID > ? ORDER BY s.ID LIMIT ?"
+        )
+        update_query = f"UPDATE {sensor} SET {field} = ? WHERE ID = ?"
+
+        conn = database.connect()
+        updated = 0
+        last_id = 0
+        start = time.monotonic()
+        try:
+            cur = conn.cursor()
+            while True:
+                cur.execute(select_query, (last_id, Calibrator.RECOMPUTE_CHUNK))
+                rows = cur.fetchall()
+                if not rows:
+                    break
+
+                ids, nodes, voltages, temperatures = (np.array(column, dtype=object) for column in zip(*rows))
+                voltages = np.array([np.nan if v is None else float(v) for v in voltages])
+                temperatures = np.array([np.nan if t is None else float(t) for t in temperatures])
+                values = self.calibrate(sensor, nodes, voltages, temperatures)
+
+                cur.executemany(update_query, [
+                    (None if np.isnan(value) else float(value), int(row_id)) for value, row_id in zip(values, ids)
+                ])
+                conn.commit()
+
+                updated += len(rows)
+                last_id = int(ids[-1])
+                logger.info(f"Recomputed {updated} {sensor} rows ({updated / (time.monotonic() - start):.0f} rows/s)")
+            cur.close()
+        finally:
+            conn.close()
+
+        return updated
+
+
+if __name__ == "__main__":
+    from database import Database
+
+    parser = argparse.ArgumentParser(description="Recompute calibrated columns from stored raw voltages")
+    parser.add_argument("--recompute", nargs="+", choices=sorted(DEFAULT_CURVES), required=True,
+                        help="sensor tables to recompute")
+    parser.add_argument("--calibration-file", default=CALIBRATION_FILE)
+    args = parser.parse_args()
+
+    calibrator = Calibrator(args.calibration_file)
+    for sensor_name in args.recompute:
+        calibrator.recompute(Database(), sensor_name)
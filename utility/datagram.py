@@ -0,0 +1,133 @@
+# datagram.py
+from typing import Dict, Any, Tuple
+import struct
+import json
+import zlib
+
+"""
+    Compact datagram used for high-frequency, loss tolerant readings:
+        header (16 bytes, network byte order)
+            magic       2s  b"AG"
+            version     B   1
+            flags       B   reserved, 0
+            node        H   node id
+            session     I   random per client start, so a restarted node is told apart from reordering
+            sequence    I   per-session counter starting at 0, wraps at 2^32
+            length      H   payload length
+        payload             compact JSON of the same packet dict sent over TCP
+        crc32       I       over header and payload
+"""
+MAGIC = b"AG"
+VERSION = 1
+HEADER = struct.Struct("!2sBBHIIH")
+TRAILER = struct.Struct("!I")
+MAX_DATAGRAM = 1200 # bytes, stays below the path MTU so datagrams are never fragmented
+SEQUENCE_MODULO = 2 ** 32
+
+
+def encode_datagram(node: int, session: int, sequence: int, data: Dict[str, Any]) -> bytes:
+    """
+        Pack a packet dict into a checksummed datagram
+            *args -> int node id, int session id, int sequence number, dict sensor data
+    """
+    payload = json.dumps(data, separators=(",", ":")).encode("utf-8")
+    datagram = HEADER.pack(MAGIC, VERSION, 0, node, session, sequence % SEQUENCE_MODULO, len(payload)) + payload
+    datagram += TRAILER.pack(zlib.crc32(datagram))
+
+    if len(datagram) > MAX_DATAGRAM:
+        raise ValueError(f"Datagram of {len(datagram)} bytes exceeds {MAX_DATAGRAM} bytes.")
+    return datagram
+
+def decode_datagram(datagram: bytes) -> Tuple[int, int, int, Dict[str, Any]]:
+    """
+        Validate and unpack a datagram, raises ValueError if it is malformed
+            *args -> bytes datagram
+    """
+    if len(datagram) < HEADER.size + TRAILER.size:
+        raise ValueError(f"Datagram too short ({len(datagram)} bytes).")
+
+    magic, version, _, node, session, sequence, length = HEADER.unpack_from(datagram)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Unknown datagram magic {magic!r} or version {version}.")
+    if HEADER.size + length + TRAILER.size != len(datagram):
+        raise ValueError(f"Datagram length mismatch, header says {length} payload bytes.")
+
+    (checksum,) = TRAILER.unpack_from(datagram, HEADER.size + length)
+    if zlib.crc32(datagram[:HEADER.size + length]) != checksum:
+        raise ValueError("Datagram checksum mismatch.")
+
+    data = json.loads(datagram[HEADER.size:HEADER.size + length].decode("utf-8"))
+    if not isinstance(data, dict):
+        raise ValueError("Datagram payload is not a packet dict.")
+    return node, session, sequence, data
+
+
+class SequenceTracker(object):
+    """
+        SequenceTracker estimates per-node datagram loss from sequence number gaps. A bitmap
+        of the last REORDER_WINDOW sequences lets late (reordered) datagrams fill the gap
+        they were counted in and lets duplicates be dropped; datagrams even older than the
+        window are dropped as stale. A new session id means the node restarted and its
+        sequence starts over; datagrams still in flight from the previous session are stale.
+    """
+
+    REORDER_WINDOW = 64
+
+    def __init__(self) -> None:
+        self.__nodes = {}
+
+    def record(self, node: int, session: int, sequence: int) -> bool:
+        """
+            Method for recording a received sequence number, returns False for duplicate and stale datagrams
+                *args -> int node id, int session id, int sequence number
+        """
+        state = self.__nodes.get(node)
+        if state is None:
+            self.__nodes[node] = {"session": session, "previous_session": None, "highest": sequence, "seen": 1,
+                                  "received": 1, "lost": 0, "duplicates": 0, "stale": 0, "restarts": 0}
+            return True
+
+        if session != state["session"]:
+            if session == state["previous_session"]:
+                state["stale"] += 1
+                return False
+            state["restarts"] += 1
+            state["previous_session"], state["session"] = state["session"], session
+            state["highest"], state["seen"] = sequence, 1
+            state["received"] += 1
+            return True
+
+        ahead = (sequence - state["highest"]) % SEQUENCE_MODULO
+        behind = (state["highest"] - sequence) % SEQUENCE_MODULO
+
+        if ahead == 0 or (behind < SequenceTracker.REORDER_WINDOW and state["seen"] >> behind & 1):
+            state["duplicates"] += 1
+            return False
+
+        if ahead < SEQUENCE_MODULO // 2:
+            state["lost"] += ahead - 1
+            state["highest"] = sequence
+            state["seen"] = ((state["seen"] << ahead) | 1) & ((1 << SequenceTracker.REORDER_WINDOW) - 1)
+        elif behind < SequenceTracker.REORDER_WINDOW:
+            state["seen"] |= 1 << behind
+            state["lost"] = max(0, state["lost"] - 1)
+        else:
+            # Too old to tell apart from a duplicate; it stays counted as lost
+            state["stale"] += 1
+            return False
+
+        state["received"] += 1
+        return True
+
+    @property
+    def loss(self) -> Dict[int, Dict[str, Any]]:
+        """
+            Property method for per-node counters and loss rate
+        """
+        report = {}
+        for node, state in self.__nodes.items():
+            expected = state["received"] + state["lost"]
+            report[node] = {key: value for key, value in state.items()
+                            if key not in ("session", "previous_session", "seen")}
+            report[node]["loss_rate"] = state["lost"] / expected if expected else 0.0
+        return report
@@ -0,0 +1,254 @@
+# profiler.py
+from typing import Callable, Dict, Any
+from collections import Counter
+from .logger import logger
+import tracemalloc
+import threading
+import datetime
+import asyncio
+import cProfile
+import signal
+import pstats
+import time
+import sys
+import io
+import os
+
+
+class Profiler(object):
+    """
+        Profiler lets a running hub be diagnosed without restarting it. Captures run for a
+        number of seconds and are written to timestamped files in output_dir.
+            SIGUSR1 --> cProfile capture of the event loop for PROFILE_SECONDS
+            SIGUSR2 --> task/loop-lag report and tracemalloc top allocations
+            control socket, one command per connection, e.g.
+                echo "sample 20" | nc -U /tmp/agcenter.sock
+                    profile [seconds] --> cProfile capture of the event loop thread
+                    sample [seconds]  --> stack sampling of every thread (folded stacks for flamegraph.pl)
+                    memory [seconds]  --> tracemalloc top allocations after tracing for seconds
+                    tasks             --> asyncio task counts, event-loop lag and process metrics
+            socket_path --> Unix socket for control commands (owner-only permissions)
+            output_dir --> directory result files are written to
+            metrics --> optional callable returning a dict included in task reports (e.g. Server.metrics)
+    """
+
+    PROFILE_SECONDS = 30
+    MAX_SECONDS = 600
+    SAMPLE_INTERVAL = 0.01 # in seconds
+    LAG_INTERVAL = 0.5 # in seconds
+    TOP_ALLOCATIONS = 25
+    TOP_FUNCTIONS = 50
+    SOCKET_PATH = "/tmp/agcenter.sock"
+    OUTPUT_DIR = "profiles"
+
+    def __init__(self,
+                 socket_path: str=SOCKET_PATH,
+                 output_dir: str=OUTPUT_DIR,
+                 metrics: Callable[[], Dict[str, Any]]=None ) -> None:
+        self.__socket_path = socket_path
+        self.__output_dir = output_dir
+        self.__metrics = metrics
+        self.__busy = set()
+        self.__lag = {"last": 0.0, "max": 0.0, "mean": 0.0}
+
+    def _output_path(self, kind: str, extension: str) -> str:
+        """
+            Method for building a timestamped result file path
+                *args -> str capture kind, str file extension
+        """
+        os.makedirs(self.__output_dir, exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        return os.path.join(self.__output_dir, f"{kind}-{os.getpid()}-{stamp}.{extension}")
+
+    async def start(self) -> None:
+        """
+            Install the signal handlers, start the lag monitor and serve the control socket
+        """
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGUSR1, lambda: asyncio.ensure_future(self.profile(Profiler.PROFILE_SECONDS)))
+        loop.add_signal_handler(signal.SIGUSR2, lambda: asyncio.ensure_future(self._signal_report()))
+
+        if os.path.exists(self.__socket_path):
+            os.remove(self.__socket_path)
+        _server = await asyncio.start_unix_server(self._process_command, path=self.__socket_path)
+        os.chmod(self.__socket_path, 0o600)
+
+        async with _server:
+            logger.info(f"Profiler control socket at {self.__socket_path} (pid {os.getpid()})")
+            await asyncio.gather(_server.serve_forever(), self._monitor_lag())
+
+    async def _monitor_lag(self) -> None:
+        """
+            Method for measuring how late the event loop wakes up a sleeping task
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(Profiler.LAG_INTERVAL)
+            lag = max(0.0, loop.time() - started - Profiler.LAG_INTERVAL)
+            self.__lag["last"] = lag
+            self.__lag["max"] = max(self.__lag["max"], lag)
+            self.__lag["mean"] = 0.9 * self.__lag["mean"] + 0.1 * lag
+
+    async def _process_command(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+            Method for running one control socket command and replying with its result
+        """
+        try:
+            line = (await asyncio.wait_for(reader.readline(), timeout=10)).decode().split()
+            command = line[0].lower() if line else "help"
+            seconds = min(float(line[1]), Profiler.MAX_SECONDS) if len(line) > 1 else Profiler.PROFILE_SECONDS
+
+            if command == "profile":
+                reply = await self.profile(seconds)
+            elif command == "sample":
+                reply = await self.sample(seconds)
+            elif command == "memory":
+                reply = await self.memory(seconds)
+            elif command == "tasks":
+                reply = self.tasks()
+            else:
+                reply = "commands: profile [seconds] | sample [seconds] | memory [seconds] | tasks"
+
+            writer.write(f"{reply}\n".encode("utf-8"))
+            await writer.drain()
+        except (ValueError, asyncio.TimeoutError) as command_error:
+            writer.write(f"error: {command_error}\n".encode("utf-8"))
+        except Exception as e:
+            logger.exception(f"Error running profiler command: {e}")
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+    def _claim(self, kind: str) -> bool:
+        """
+            Method for allowing only one capture of each kind at a time
+        """
+        if kind in self.__busy:
+            return False
+        self.__busy.add(kind)
+        return True
+
+    async def profile(self, seconds: float) -> str:
+        """
+            Method for a cProfile capture of the event loop thread
+                *args -> float seconds
+        """
+        if not self._claim("profile"):
+            return "profile capture already running"
+
+        logger.info(f"Starting {seconds}s cProfile capture...")
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+            await asyncio.sleep(seconds)
+        finally:
+            profile.disable()
+            self.__busy.discard("profile")
+
+        path = self._output_path("profile", "pstats")
+        profile.dump_stats(path)
+
+        summary = io.StringIO()
+        pstats.Stats(profile, stream=summary).sort_stats("cumulative").print_stats(Profiler.TOP_FUNCTIONS)
+        with open(path.replace(".pstats", ".txt"), "w") as file:
+            file.write(summary.getvalue())
+
+        logger.info(f"cProfile capture written to {path}")
+        return path
+
+    def _sample_stacks(self, seconds: float, stacks: Counter) -> None:
+        """
+            Method run on a helper thread that counts the stacks of every other thread
+        """
+        own_id = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                names = []
+                while frame is not None:
+                    names.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+                    frame = frame.f_back
+                stacks[";".join(reversed(names))] += 1
+            time.sleep(Profiler.SAMPLE_INTERVAL)
+
+    async def sample(self, seconds: float) -> str:
+        """
+            Method for a low overhead sampling capture written as folded stacks
+                *args -> float seconds
+        """
+        if not self._claim("sample"):
+            return "sample capture already running"
+
+        logger.info(f"Starting {seconds}s stack sampling...")
+        stacks = Counter()
+        try:
+            await asyncio.to_thread(self._sample_stacks, seconds, stacks)
+        finally:
+            self.__busy.discard("sample")
+
+        path = self._output_path("sample", "folded")
+        with open(path, "w") as file:
+            for stack, count in stacks.most_common():
+                file.write(f"{stack} {count}\n")
+
+        logger.info(f"Stack samples written to {path}")
+        return path
+
+    async def memory(self, seconds: float) -> str:
+        """
+            Method for tracing allocations for a while and writing the top allocation sites
+                *args -> float seconds
+        """
+        if not self._claim("memory"):
+            return "memory capture already running"
+
+        started_here = not tracemalloc.is_tracing()
+        try:
+            if started_here:
+                tracemalloc.start(25)
+            await asyncio.sleep(seconds)
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            if started_here:
+                tracemalloc.stop()
+            self.__busy.discard("memory")
+
+        path = self._output_path("memory", "txt")
+        with open(path, "w") as file:
+            file.write(f"traced current {current / 1024:.1f} KiB, peak {peak / 1024:.1f} KiB\n\n")
+            for stat in snapshot.statistics("lineno")[:Profiler.TOP_ALLOCATIONS]:
+                file.write(f"{stat}\n")
+
+        logger.info(f"Allocation report written to {path}")
+        return path
+
+    def tasks(self) -> str:
+        """
+            Method for reporting asyncio tasks, event-loop lag and process metrics
+        """
+        tasks = asyncio.all_tasks()
+        by_coroutine = Counter(task.get_coro().__qualname__ for task in tasks)
+
+        lines = [
+            f"pid {os.getpid()}: {len(tasks)} tasks, {threading.active_count()} threads",
+            f"loop lag: last {self.__lag['last'] * 1000:.1f} ms, mean {self.__lag['mean'] * 1000:.1f} ms, max {self.__lag['max'] * 1000:.1f} ms"
+        ]
+        lines += [f"  {count:5d} {name}" for name, count in by_coroutine.most_common()]
+        if self.__metrics:
+            lines.append(f"metrics: {self.__metrics()}")
+
+        report = "\n".join(lines)
+        with open(self._output_path("tasks", "txt"), "w") as file:
+            file.write(report + "\n")
+        return report
+
+    async def _signal_report(self) -> None:
+        """
+            Method run on SIGUSR2: task report followed by an allocation capture
+        """
+        logger.info(self.tasks())
+        await self.memory(Profiler.PROFILE_SECONDS)
@@ -0,0 +1,131 @@
+# scheduler.py
+from typing import Dict, List, Tuple
+from .logger import logger
+import datetime
+import asyncio
+import math
+import time
+
+
+class Scheduler(object):
+    """
+        Scheduler produces drift-free sampling ticks for jobs running at different cadences.
+        Every job is aligned to wall-clock boundaries of its interval (e.g. a 20 minute job
+        fires at :00, :20 and :40) but deadlines are tracked on the monotonic clock, so the
+        schedule never accumulates error from sleep overshoot or processing time.
+            intervals --> key is str job name, value is interval in seconds
+            coalesce_window --> jobs due within this many seconds of the wake-up are batched
+
+        Missed ticks (e.g. a slow camera capture overrunning the next pH reading) are not
+        replayed: every overdue job runs once in the same batch, the skipped ticks are counted
+        and logged, and each job moves on to its next future boundary. A late batch is stamped
+        with the time it actually runs rather than the deadline it missed.
+    """
+
+    COALESCE_WINDOW = 1.0 # in seconds
+    RESYNC_THRESHOLD = 2.0 # wall clock step (in seconds) that forces a realignment, e.g. NTP sync after boot
+
+    def __init__(self, intervals: Dict[str, float], coalesce_window: float=COALESCE_WINDOW) -> None:
+        if not intervals:
+            raise ValueError("Scheduler requires at least one job interval.")
+        if any(interval <= 0 for interval in intervals.values()):
+            raise ValueError(f"Scheduler intervals must be positive: {intervals}")
+
+        self.__intervals = dict(intervals)
+        self.__coalesce_window = coalesce_window
+        self.__epoch_offset, self.__utc_offset = self._clock_offsets()
+        self.__next_due = {}
+        self.__missed = {name: 0 for name in self.__intervals}
+        self._align()
+
+    @staticmethod
+    def _clock_offsets() -> Tuple[float, float]:
+        """
+            Method for sampling the offset between the monotonic and epoch clocks and
+            the local UTC offset used to align boundaries to local wall time
+        """
+        epoch_offset = time.time() - time.monotonic()
+        utc_offset = datetime.datetime.now().astimezone().utcoffset().total_seconds()
+        return epoch_offset, utc_offset
+
+    def _align(self) -> None:
+        """
+            Method for setting every job's deadline to its next wall-clock boundary
+        """
+        now = time.monotonic()
+        for name, interval in self.__intervals.items():
+            local_wall = now + self.__epoch_offset + self.__utc_offset
+            next_boundary = (math.floor(local_wall / interval) + 1) * interval
+            self.__next_due[name] = next_boundary - self.__epoch_offset - self.__utc_offset
+
+    def _resync(self) -> None:
+        """
+            Method for realigning the schedule if the wall clock was stepped
+        """
+        epoch_offset, utc_offset = self._clock_offsets()
+        step = (epoch_offset + utc_offset) - (self.__epoch_offset + self.__utc_offset)
+
+        if abs(step) > Scheduler.RESYNC_THRESHOLD:
+            logger.warning(f"Wall clock stepped by {step:.1f} seconds. Realigning schedule...")
+            self.__epoch_offset, self.__utc_offset = epoch_offset, utc_offset
+            self._align()
+
+    def _advance(self, name: str, now: float) -> None:
+        """
+            Method for moving a job to its next tick, skipping ticks that already passed
+                *args -> str job name, float monotonic now
+        """
+        interval = self.__intervals[name]
+        due = self.__next_due[name]
+        skipped = max(0, math.floor((now - due) / interval))
+
+        if skipped:
+            self.__missed[name] += skipped
+            logger.warning(f"{name} missed {skipped} tick(s); skipping to next boundary.")
+
+        self.__next_due[name] = due + (skipped + 1) * interval
+
+    @property
+    def missed(self) -> Dict[str, int]:
+        """
+            Property method for the number of skipped ticks per job
+        """
+        return dict(self.__missed)
+
+    def seconds_until_next(self) -> float:
+        """
+            Method for the time remaining until the earliest job is due
+        """
+        return max(0.0, min(self.__next_due.values()) - time.monotonic())
+
+    async def next_batch(self) -> Tuple[datetime.datetime, List[str]]:
+        """
+            Sleep until the next tick and return when it runs together with every job that
+            is due by then: the latest boundary that passed for an on-time batch, the
+            actual time for a batch that was held up past its deadline
+        """
+        self._resync()
+
+        earliest = min(self.__next_due.values())
+        delay = earliest - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        now = time.monotonic()
+        due = [name for name, deadline in self.__next_due.items()
+               if deadline <= now + self.__coalesce_window]
+
+        latest_boundary = earliest
+        for name in due:
+            deadline, interval = self.__next_due[name], self.__intervals[name]
+            if deadline <= now:
+                latest_boundary = max(latest_boundary, deadline + math.floor((now - deadline) / interval) * interval)
+            self._advance(name, now)
+
+        if now - latest_boundary <= self.__coalesce_window:
+            sampled_at = round(latest_boundary + self.__epoch_offset)
+        else:
+            # Truncated so a late batch can never land on the next boundary's timestamp
+            sampled_at = math.floor(now + self.__epoch_offset)
+        tick = datetime.datetime.fromtimestamp(sampled_at)
+        return tick, due
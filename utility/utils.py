@@ -3,7 +3,11 @@ from adafruit_ads1x15.analog_in import AnalogIn
 import adafruit_ads1x15.ads1115 as ADS
 import utility.config as config
 from libcamera import Transform
-from typing import Union, Dict, Any
+from typing import Union, Optional
+from helpers.sink import SinkDispatcher, Sink, SinkThread
+from .calibration import Calibrator
+from .alerts import AlertManager
+from .scheduler import Scheduler
 from .logger import logger
 from busio import I2C
 import picamera2
@@ -18,9 +22,19 @@ class Controller(object):
     """
         Controller handles sensor object creation, management, and data collection
             sensor_dict --> key is str sensor name, value is Analog Pin object
+            sensor_intervals --> key is str sensor name, value is sampling interval in seconds
+                                 (sensors not listed are sampled every STAGGER_INTERVAL minutes)
+            calibrator --> Calibrator converting raw voltages before storage
+            alerts --> AlertManager evaluating rolling-window rules on every reading
+            dispatcher --> SinkDispatcher shared with the Server, built from the writers if None
     """
 
+    SCP_TIMEOUT = 120 # in seconds
     STAGGER_INTERVAL = 20 # in minutes
+    SENSOR_INTERVALS = {
+        "PH_Meter": 60,
+        "Camera": 20 * 60
+    } # in seconds
 
     def __init__(self,
                  sensor_list: list,
@@ -30,17 +44,28 @@ class Controller(object):
                  store_drive: bool=config.STORE_DRIVE,
                  database=None,
                  drive_writer=None,
-                 local_writer = None ) -> None:
+                 local_writer = None,
+                 sensor_intervals: dict=None,
+                 calibrator: Calibrator=None,
+                 alerts: AlertManager=None,
+                 dispatcher: SinkDispatcher=None ) -> None:
         self.__sensor_list = sensor_list
         self.__i2c_bus = i2c_bus
         self.__store_locally = store_locally
-        self.__store_database = store_database
-        self.__store_drive = store_drive
-        self.__database = database
-        self.__GSWriter = drive_writer
-        self.__XLSXWriter = local_writer
+        self.__dispatcher = dispatcher or SinkDispatcher(
+            database=database,
+            drive_writer=drive_writer,
+            local_writer=local_writer,
+            store_database=store_database,
+            store_local=store_locally,
+            store_drive=store_drive
+        )
+        self.__scp_sink = Sink("scp", self._ssh_copy_to_hub, SinkThread("scp"), timeout=Controller.SCP_TIMEOUT) if config.SCP_COPY else None
+        self.__calibrator = calibrator or Calibrator()
+        self.__alerts = alerts or AlertManager()
         self.__object_map = self._create_object_map()
         self.__current_objects = self._create_objects()
+        self.__scheduler = self._create_scheduler(sensor_intervals or Controller.SENSOR_INTERVALS)
 
     def _create_object_map(self) -> dict:
         """
@@ -49,7 +74,7 @@ class Controller(object):
         logger.info("Mapping existing classes...")
         object_map = {}
 
-        for name, obj in inspect.getmemebers(sys.modules[__name__]):
+        for name, obj in inspect.getmembers(sys.modules[__name__]):
             if inspect.isclass(obj):
                 object_map[name] = obj
 
@@ -81,22 +106,43 @@ class Controller(object):
         logger.info("Generation complete.")
         return objects
     
+    def _create_scheduler(self, sensor_intervals: dict) -> Scheduler:
+        """
+            Method for building the sampling schedule of the created sensor objects
+                *args -> dict sensor name to interval in seconds
+        """
+        intervals = {}
+        for sensor in self.__current_objects:
+            name = type(sensor).__name__
+            intervals[name] = sensor_intervals.get(name, Controller.STAGGER_INTERVAL * 60)
+
+        if not intervals:
+            intervals["idle"] = Controller.STAGGER_INTERVAL * 60
+
+        logger.info(f"Sampling intervals (seconds): {intervals}")
+        return Scheduler(intervals)
+
     async def gather_sensor_data(self) -> None:
         """
-            Method for collecting all sensor object data
+            Method for collecting sensor object data whenever the scheduler reports
+            them due; sensors due on the same tick are collected as one batch
         """
         while True:
-            current_time = datetime.datetime.now().strftime("%m-%d-%Y@%H:%M:%S")
+            tick, due = await self.__scheduler.next_batch()
+            current_time = tick.strftime("%m-%d-%Y@%H:%M:%S")
             sensor_data = {}
-            logger.info("Collecting data...")
+            logger.info(f"Collecting data from {', '.join(due)}...")
 
             image_path = None
             for sensor in self.__current_objects:
+                if type(sensor).__name__ not in due:
+                    continue
+
                 data = None
                 if isinstance(sensor, Camera):
                     image_path = await sensor.capture_image()
                     if image_path is not None and config.SCP_COPY:
-                        await self._ssh_copy_to_hub(image_path)
+                        self.__scp_sink.submit(image_path)
                 else:
                     data = await sensor.package(current_time)
                 if data is not None:
@@ -105,13 +151,13 @@ class Controller(object):
             logger.info("Collection complete.")
 
             if sensor_data:
-                await self._write_to_database(sensor_data)
-                await self._write_to_file(data=sensor_data, timestamp=current_time, image_path=image_path)
+                self.__calibrator.apply(sensor_data)
+                self.__alerts.evaluate(sensor_data)
 
-            next_reading = await self._calc_next_reading()
-            logger.info(f"Next reading in {next_reading} seconds.")
+            # Sinks write independently, a slow backend never delays the next sampling tick
+            self.__dispatcher.dispatch(data=sensor_data, timestamp=current_time, image_path=image_path)
 
-            await asyncio.sleep(next_reading)
+            logger.info(f"Next reading in {self.__scheduler.seconds_until_next():.1f} seconds.")
 
     async def _ssh_copy_to_hub(self, image_path: str) -> None:
         """
@@ -129,41 +175,6 @@ class Controller(object):
                 del_command = f"rm {image_path}"
                 os.system(del_command)
 
-    async def _write_to_file(self, data: Dict[str, Any], timestamp: str, image_path: str=None) -> None:
-        """
-            Optional method for storing data locally
-                *args -> dict sensor data
-        """
-        if self.__store_locally and self.__XLSXWriter:
-            await self.__XLSXWriter.write_sensor_data(data)
-        if self.__store_drive and self.__GSWriter:
-            await self.__GSWriter.write_sensor_data(sensor_dict=data, timestamp_recv=timestamp)
-            if image_path:
-                await self.__GSWriter.upload_to_google_drive(abs_image_path=image_path)
-
-    async def _write_to_database(self, data: dict) -> None:
-        """
-            Method for acquiring database lock and writing to database
-                *args -> dict sensor data
-        """
-        if self.__database:
-            for key in data.keys():
-                await self.__database.write(key, data[key])
-        else:
-            logger.warning(f"No database was established. Current database is {self.__database}")
-
-    async def _calc_next_readings(self) -> int:
-        """
-            Method for determing how long to wait until next readings
-        """
-        logger.info("Calculating next reading...")
-
-        current_time = datetime.datetime.now()
-        minutes_next = Controller.STAGGER_INTERVAL - int(current_time.minute % Controller.STAGGER_INTERVAL)
-        next_reading = (minutes_next * 60) + current_time.second
-
-        return next_reading
-    
 class Camera(picamera2.Picamera2):
     """
         Camera handles all image/video creation
@@ -244,7 +255,7 @@ class ADC_Analog(object):
 """
 class TDS_Meter(ADC_Analog):
     def __init__( self, i2c_bus: I2C, address: int=config.ADC_ADDR, channel=config.TDS_CHAN ) -> None:
-        super().__int__( i2c_bus, address, channel )
+        super().__init__( i2c_bus, address, channel )
         self.__max_voltage = 2.3
         self.__max_ppm = 1000
         self.__ratio = self.__max_voltage / self.__max_ppm
@@ -252,8 +263,9 @@ class TDS_Meter(ADC_Analog):
     async def _convert_to_ppm(self, voltage: float) -> int:
         """
             Method for converting raw voltage readings to parts per million readings
+            (the hub replaces this with a temperature compensated value, see utility.calibration)
         """
-        return int(voltage * self.__ratio)
+        return int(voltage / self.__ratio)
     
     @property
     async def _read_analog(self) -> bool:
@@ -261,7 +273,7 @@ class TDS_Meter(ADC_Analog):
             Property method for retreiving analog readings for ADS1115
         """
         try:
-            self.__TDS_Dict = {
+            self.__TDS_dict = {
                 "Node": config.NODE,
                 "DT": None,
                 "raw_value": None,
@@ -274,7 +286,7 @@ class TDS_Meter(ADC_Analog):
 
             self.__TDS_dict["raw_value"] = value
             self.__TDS_dict["raw_voltage"] = voltage
-            self.__TDS_dict["PPPM"] = await self._convert_to_ppm(voltage)
+            self.__TDS_dict["PPM"] = await self._convert_to_ppm(voltage)
             #ppms = list(map(self._convert_to_ppm, voltages))
 
             return True
@@ -282,14 +294,14 @@ class TDS_Meter(ADC_Analog):
             logger.error(f"Error: {runtime_error} while reading TDS analog.")
             return False
         
-    async def package(self, date_time: datetime.dattime) -> Optional(dict, None):
+    async def package(self, date_time: datetime.datetime) -> Optional[dict]:
         """
             Method for packaging data into dictionary with sensor name as key
                 *args --> datetime date time
         """
         if await self._read_analog:
             self.__TDS_dict["DT"] = date_time
-            data = {"TDS_Meter": self.__TDS_Dict}
+            data = {"TDS_Meter": self.__TDS_dict}
             return data
         return None
     
@@ -330,7 +342,7 @@ class Turbidity_Meter(ADC_Analog):
             logger.error(f"Error: {runtime_error} while reading Turbidity analog.")
             return False
         
-    async def package(self, date_time: datetime.datetime) -> Optional(dict, None):
+    async def package(self, date_time: datetime.datetime) -> Optional[dict]:
         """
             Method for packaging data into dictionary with sensor name as key
                 *args --> datetime date time
@@ -380,7 +392,7 @@ class PH_Meter(ADC_Analog):
             logger.error(f"Error: {runtime_error} while reading PH analog.")
             return False
         
-    async def package(self, date_time: datetime.datetime) -> Optional(dict, None):
+    async def package(self, date_time: datetime.datetime) -> Optional[dict]:
         """
             Method for packaging data into dictionary with sensor name as key
         """